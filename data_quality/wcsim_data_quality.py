@@ -23,19 +23,21 @@ def process_fileset(name, files):
     digiHitTime.GetXaxis().SetTitleSize(0.05)
     digiHitCharge.GetXaxis().SetTitleSize(0.05)
     totalCharge.GetXaxis().SetTitleSize(0.05)
-    for ev in range(wcsim.nevent):
-        if ev % 100 == 0: print("event", ev, "of", wcsim.nevent, flush=True)
-        wcsim.get_event(ev)
-        trigger = wcsim.get_first_trigger()
-        ncherenkovdigihits = trigger.GetNcherenkovdigihits()
-        totalQ = 0
-        for i in range(ncherenkovdigihits):
-            hit = trigger.GetCherenkovDigiHits().At(i)
-            digiHitTime.Fill(hit.GetT())
-            Q = hit.GetQ()
-            totalQ += Q
-            digiHitCharge.Fill(Q)
-        totalCharge.Fill(totalQ)
+    for batch in wcsim.iter_batches(fields=("digitized_hits", "triggers"), batch_size=100):
+        print("event", batch["event_id"][0], "of", wcsim.nevent, flush=True)
+        triggers = batch["triggers"]
+        hits = batch["digitized_hits"]
+        nevents = len(batch["event_id"])
+        # only use the hits in the first trigger of each event
+        first_trigger = first_trigger_indices(triggers["time"], triggers["event_offsets"])
+        hit_event = np.repeat(np.arange(nevents), np.diff(hits["event_offsets"]))
+        first_trigger_hits = hits["trigger"] == first_trigger[hit_event]
+        times = hits["time"][first_trigger_hits].astype(np.float64)
+        charges = hits["charge"][first_trigger_hits].astype(np.float64)
+        totalQ = np.bincount(hit_event[first_trigger_hits], weights=charges, minlength=nevents)
+        digiHitTime.FillN(len(times), times, np.ones_like(times))
+        digiHitCharge.FillN(len(charges), charges, np.ones_like(charges))
+        totalCharge.FillN(nevents, totalQ, np.ones_like(totalQ))
     if not os.path.isdir(name):
         os.mkdir(name)
     path=os.path.abspath(name)
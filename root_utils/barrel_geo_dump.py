@@ -20,12 +20,7 @@ def geodump(input_file, output_file):
     wcsim = WCSimFile(input_file)
 
 
-    np_pos_x_all_tubes = np.zeros(wcsim.num_pmts)
-    np_pos_y_all_tubes = np.zeros(wcsim.num_pmts)
-    np_pos_z_all_tubes = np.zeros(wcsim.num_pmts)
-    np_dir_x_all_tubes = np.zeros(wcsim.num_pmts)
-    np_dir_y_all_tubes = np.zeros(wcsim.num_pmts)
-    np_dir_z_all_tubes = np.zeros(wcsim.num_pmts)
+    geometry = wcsim.get_pmt_geometry()
 
     np_pmt_index_all_tubes = np.arange(wcsim.num_pmts)
 
@@ -33,14 +28,8 @@ def geodump(input_file, output_file):
 
     np_module_index_all_tubes = module_index(np_pmt_index_all_tubes)
 
-    for i in range(len(np_pmt_index_all_tubes)):
-        pmt = wcsim.geo.GetPMT(int(np_pmt_index_all_tubes[i]))
-        np_pos_x_all_tubes[i] = pmt.GetPosition(0)
-        np_pos_y_all_tubes[i] = pmt.GetPosition(1)
-        np_pos_z_all_tubes[i] = pmt.GetPosition(2)
-        np_dir_x_all_tubes[i] = pmt.GetOrientation(0)
-        np_dir_y_all_tubes[i] = pmt.GetOrientation(1)
-        np_dir_z_all_tubes[i] = pmt.GetOrientation(2)
+    np_pos_x_all_tubes, np_pos_y_all_tubes, np_pos_z_all_tubes = geometry["position"][np_pmt_index_all_tubes].T
+    np_dir_x_all_tubes, np_dir_y_all_tubes, np_dir_z_all_tubes = geometry["orientation"][np_pmt_index_all_tubes].T
 
     np_wall_indices = np.where(is_barrel(np_module_index_all_tubes))
 
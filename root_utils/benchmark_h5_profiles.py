@@ -0,0 +1,78 @@
+"""
+Python 3 script for comparing the HDF5 storage profiles of h5_utils on an existing hit array file
+
+Each profile is used to write a copy of the input file's datasets, reporting the time to write it, the size of the
+resulting file and the latency of reading the hits of randomly chosen events, as done when training on hit arrays.
+Reads may be served from the page cache after the copy is written, so read latencies are best compared between
+profiles rather than taken as absolute numbers for a cold filesystem.
+"""
+
+import argparse
+import os
+import time
+import h5py
+import numpy as np
+from root_utils.h5_utils import STORAGE_PROFILES, create_dataset, chunk_bytes
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='benchmark hdf5 storage profiles by copying a hit array file')
+    parser.add_argument('input_file', type=str)
+    parser.add_argument('-d', '--output_dir', type=str, default='.', help='directory for the copies of the input')
+    parser.add_argument('-p', '--profiles', type=str, nargs='+', choices=list(STORAGE_PROFILES),
+                        default=list(STORAGE_PROFILES))
+    parser.add_argument('-n', '--events', type=int, default=1000, help='number of random events to read')
+    parser.add_argument('-k', '--keep', action='store_true', help='keep the copies of the input file')
+    args = parser.parse_args()
+    return args
+
+
+def write_copy(in_file, output_file, profile):
+    """Copy all datasets of the open input file into a new file with the given profile, returning the time taken"""
+    start_time = time.perf_counter()
+    with h5py.File(output_file, 'w') as f:
+        for name, dset in in_file.items():
+            out = create_dataset(f, name, dset.shape, dset.dtype, profile)
+            row_bytes = max(1, int(np.prod(dset.shape[1:])) * dset.dtype.itemsize)
+            block_rows = max(1, 64*chunk_bytes // row_bytes)
+            for block_start in range(0, dset.shape[0], block_rows):
+                out[block_start:block_start+block_rows] = dset[block_start:block_start+block_rows]
+    return time.perf_counter() - start_time
+
+
+def read_events(input_file, events):
+    """Read the hits of each of the given events one at a time, returning the time taken for each event"""
+    latencies = np.empty(len(events))
+    with h5py.File(input_file, 'r') as f:
+        event_hits_index = f['event_hits_index']
+        hit_datasets = [d for n, d in f.items() if n.startswith('hit_')]
+        n_hits = f['hit_pmt'].shape[0]
+        for i, event in enumerate(events):
+            start_time = time.perf_counter()
+            start = event_hits_index[event]
+            stop = event_hits_index[event+1] if event+1 < event_hits_index.shape[0] else n_hits
+            for d in hit_datasets:
+                d[start:stop]
+            latencies[i] = time.perf_counter() - start_time
+    return latencies
+
+
+if __name__ == '__main__':
+    config = get_args()
+    in_file = h5py.File(config.input_file, 'r')
+    n_events = in_file['event_hits_index'].shape[0]
+    events = np.random.RandomState(0).randint(0, n_events, size=min(config.events, n_events))
+    print("input file:", config.input_file, "with", n_events, "events,", os.path.getsize(config.input_file), "bytes")
+    print("{:>10} {:>12} {:>14} {:>18} {:>18}".format("profile", "write [s]", "size [MB]", "read mean [ms]",
+                                                      "read p99 [ms]"))
+    for profile in config.profiles:
+        output_file = os.path.join(config.output_dir, os.path.splitext(os.path.basename(config.input_file))[0]
+                                   + "_" + profile + ".h5")
+        write_time = write_copy(in_file, output_file, profile)
+        size = os.path.getsize(output_file)
+        latencies = read_events(output_file, events)*1000
+        print("{:>10} {:>12.2f} {:>14.1f} {:>18.3f} {:>18.3f}".format(profile, write_time, size/1e6, latencies.mean(),
+                                                                      np.percentile(latencies, 99)), flush=True)
+        if not config.keep:
+            os.remove(output_file)
+    in_file.close()
@@ -11,13 +11,15 @@ from matplotlib.colors import LinearSegmentedColormap as lsc
 from mpl_toolkits.axes_grid1 import ImageGrid
 from mpl_toolkits.mplot3d import Axes3D
 
-from root_utils.pos_utils import *
+from root_utils.geometry import GEOMETRIES, BARREL, BOTTOM, TOP
 from root_utils.root_file_utils import *
 
 import os
 
 ROOT.gROOT.SetBatch(True)
 
+geometry = GEOMETRIES["iwcd"]
+
 matplotlib.use('Agg')
 
 
@@ -59,25 +61,16 @@ def event_display(ev, input_file, write_dir):
 
     wcsim = WCSimFile(input_file)
 
-    np_pos_x_all_tubes = np.zeros(wcsim.num_pmts)
-    np_pos_y_all_tubes = np.zeros(wcsim.num_pmts)
-    np_pos_z_all_tubes = np.zeros(wcsim.num_pmts)
+    pmt_geometry = wcsim.get_pmt_geometry()
 
-    np_pmt_in_module_id_all_tubes = np.zeros(wcsim.num_pmts)
     np_pmt_index_all_tubes = np.arange(wcsim.num_pmts)
 
     np.random.shuffle(np_pmt_index_all_tubes)
 
-    np_module_index_all_tubes = module_index(np_pmt_index_all_tubes)
-
-    for i in range(len(np_pmt_index_all_tubes)):
-        pmt_tube_in_module_id = np_pmt_index_all_tubes[i] % 19
-        np_pmt_in_module_id_all_tubes[i] = pmt_tube_in_module_id
-        pmt = wcsim.geo.GetPMT(int(np_pmt_index_all_tubes[i]))
+    np_region_all_tubes, np_row_all_tubes, np_col_all_tubes, np_pmt_in_module_id_all_tubes = \
+        geometry.lookup(np_pmt_index_all_tubes).T
 
-        np_pos_x_all_tubes[i] = pmt.GetPosition(2)
-        np_pos_y_all_tubes[i] = pmt.GetPosition(0)
-        np_pos_z_all_tubes[i] = pmt.GetPosition(1)
+    np_pos_y_all_tubes, np_pos_z_all_tubes, np_pos_x_all_tubes = pmt_geometry["position"][np_pmt_index_all_tubes].T
 
     np_pos_r_all_tubes = np.hypot(np_pos_x_all_tubes, np_pos_y_all_tubes)
 
@@ -86,9 +79,9 @@ def event_display(ev, input_file, write_dir):
     np_pos_phi_all_tubes = np.arctan2(np_pos_y_all_tubes, np_pos_x_all_tubes)
     np_pos_arc_all_tubes = r_max * np_pos_phi_all_tubes
 
-    np_wall_indices = np.where(is_barrel(np_module_index_all_tubes))
-    np_top_indices = np.where(is_top(np_module_index_all_tubes))
-    np_bottom_indices = np.where(is_bottom(np_module_index_all_tubes))
+    np_wall_indices = np.where(np_region_all_tubes == BARREL)
+    np_top_indices = np.where(np_region_all_tubes == TOP)
+    np_bottom_indices = np.where(np_region_all_tubes == BOTTOM)
 
     np_pmt_in_module_id_wall_tubes = np_pmt_in_module_id_all_tubes[np_wall_indices]
     np_pmt_in_module_id_top_tubes = np_pmt_in_module_id_all_tubes[np_top_indices]
@@ -100,7 +93,7 @@ def event_display(ev, input_file, write_dir):
     np_pos_x_bottom_tubes = np_pos_x_all_tubes[np_bottom_indices]
     np_pos_y_bottom_tubes = np_pos_y_all_tubes[np_bottom_indices]
 
-    np_wall_row, np_wall_col = row_col(np_module_index_all_tubes[np_wall_indices])
+    np_wall_row, np_wall_col = np_row_all_tubes[np_wall_indices], np_col_all_tubes[np_wall_indices]
 
     np_pos_arc_wall_tubes = np_pos_arc_all_tubes[np_wall_indices]
 
@@ -139,14 +132,6 @@ def event_display(ev, input_file, write_dir):
     if ncherenkovdigihits == 0:
         print("event, trigger has no hits " + str(ev) + " " + str(wcsim.current_trigger))
 
-    np_pos_x = np.zeros(ncherenkovdigihits)
-    np_pos_y = np.zeros(ncherenkovdigihits)
-    np_pos_z = np.zeros(ncherenkovdigihits)
-
-    np_dir_u = np.zeros(ncherenkovdigihits)
-    np_dir_v = np.zeros(ncherenkovdigihits)
-    np_dir_w = np.zeros(ncherenkovdigihits)
-
     np_q = np.zeros(ncherenkovdigihits)
     np_t = np.zeros(ncherenkovdigihits)
 
@@ -164,30 +149,16 @@ def event_display(ev, input_file, write_dir):
         # if i<10:
         #    print("q t id: "+str(hit_q)+" "+str(hit_t)+" "+str(hit_tube_id)+" ")
 
-        pmt = wcsim.geo.GetPMT(hit_tube_id)
-
-        # if i<10:
-        #    print("pmt tube no: "+str(pmt.GetTubeNo()) #+" " +pmt.GetPMTName())
-        #    print("pmt cyl loc: "+str(pmt.GetCylLoc()))
-
-        # np_cylloc[i]=pmt.GetCylLoc()
-
-        np_pos_x[i] = pmt.GetPosition(2)
-        np_pos_y[i] = pmt.GetPosition(0)
-        np_pos_z[i] = pmt.GetPosition(1)
-
-        np_dir_u[i] = pmt.GetOrientation(2)
-        np_dir_v[i] = pmt.GetOrientation(0)
-        np_dir_w[i] = pmt.GetOrientation(1)
-
         np_q[i] = hit_q
         np_t[i] = hit_t
 
-    np_module_index = module_index(np_pmt_index)
-    np_pmt_in_module_id = pmt_in_module_id(np_pmt_index)
-    np_wall_indices = np.where(is_barrel(np_module_index))
-    np_top_indices = np.where(is_top(np_module_index))
-    np_bottom_indices = np.where(is_bottom(np_module_index))
+    np_pos_y, np_pos_z, np_pos_x = pmt_geometry["position"][np_pmt_index].T
+    np_dir_v, np_dir_w, np_dir_u = pmt_geometry["orientation"][np_pmt_index].T
+
+    np_region, np_row, np_col, np_pmt_in_module_id = geometry.lookup(np_pmt_index).T
+    np_wall_indices = np.where(np_region == BARREL)
+    np_top_indices = np.where(np_region == TOP)
+    np_bottom_indices = np.where(np_region == BOTTOM)
 
     np_pos_phi = np.arctan2(np_pos_y, np_pos_x)
     np_pos_arc = r_max * np_pos_phi
@@ -203,15 +174,15 @@ def event_display(ev, input_file, write_dir):
     np_q_wall = np_q[np_wall_indices]
     np_t_wall = np_t[np_wall_indices]
 
-    np_wall_row, np_wall_col = row_col(np_module_index[np_wall_indices])
+    np_wall_row, np_wall_col = np_row[np_wall_indices], np_col[np_wall_indices]
     np_pmt_in_module_id_wall = np_pmt_in_module_id[np_wall_indices]
-    np_wall_data_rect = np.zeros((16, 40, 38))
+    np_wall_data_rect = np.zeros(geometry.grid_shape)
     np_wall_data_rect[np_wall_row,
                       np_wall_col,
                       np_pmt_in_module_id_wall] = np_q_wall
     np_wall_data_rect[np_wall_row,
                       np_wall_col,
-                      np_pmt_in_module_id_wall + 19] = np_t_wall
+                      np_pmt_in_module_id_wall + geometry.pmts_per_module] = np_t_wall
     np_wall_q_max_module = np.amax(np_wall_data_rect[:, :, 0:19], axis=-1)
     np_wall_q_sum_module = np.sum(np_wall_data_rect[:, :, 0:19], axis=-1)
 
@@ -8,8 +8,11 @@ Authors: Nick Prouse
 """
 
 import argparse
+import multiprocessing
+import queue
 from root_utils.root_file_utils import *
 from root_utils.pos_utils import *
+from root_utils.flat_npz import OFFSETS, split_by_event, concatenate_offsets, offsets_name, save_flat, EventFile
 
 ROOT.gROOT.SetBatch(True)
 
@@ -18,120 +21,205 @@ def get_args():
     parser = argparse.ArgumentParser(description='dump WCSim data into numpy .npz file')
     parser.add_argument('input_files', type=str, nargs='+')
     parser.add_argument('-d', '--output_dir', type=str, default=None)
+    parser.add_argument('-c', '--columnar', action='store_true',
+                        help='read each file in bulk with WCSimColumns instead of event by event')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes to convert files in parallel')
+    parser.add_argument('-n', '--events-per-task', type=int, default=None,
+                        help='split files into ranges of this many events converted in parallel, only with --jobs')
+    parser.add_argument('-f', '--fields', type=parse_fields, default=list(FIELD_GROUPS),
+                        help='comma separated groups of data to dump, from: ' + ','.join(FIELD_GROUPS) +
+                             ' (default: all)')
+    parser.add_argument('--flat', action='store_true',
+                        help='store per-event arrays as flat typed arrays with event offsets, uncompressed so they can '
+                             'be memory-mapped, instead of compressed object arrays')
     args = parser.parse_args()
+    if args.events_per_task is not None and args.jobs <= 1:
+        parser.error('--events-per-task only applies when converting in parallel with --jobs')
     return args
 
 
-def dump_file(infile, outfile):
-
-    wcsim = WCSimFile(infile)
-    nevents = wcsim.nevent
-
-    # All data arrays are initialized here
-
-    event_id = np.empty(nevents, dtype=np.int32)
-    root_file = np.empty(nevents, dtype=object)
-
-    pid = np.empty(nevents, dtype=np.int32)
-    position = np.empty((nevents, 3), dtype=np.float64)
-    direction = np.empty((nevents, 3), dtype=np.float64)
-    energy = np.empty(nevents,dtype=np.float64)
-
-    digi_hit_pmt = np.empty(nevents, dtype=object)
-    digi_hit_charge = np.empty(nevents, dtype=object)
-    digi_hit_time = np.empty(nevents, dtype=object)
-    digi_hit_trigger = np.empty(nevents, dtype=object)
-
-    true_hit_pmt = np.empty(nevents, dtype=object)
-    true_hit_time = np.empty(nevents, dtype=object)
-    true_hit_pos = np.empty(nevents, dtype=object)
-    true_hit_start_time = np.empty(nevents, dtype=object)
-    true_hit_start_pos = np.empty(nevents, dtype=object)
-    true_hit_parent = np.empty(nevents, dtype=object)
-
-    track_id = np.empty(nevents, dtype=object)
-    track_pid = np.empty(nevents, dtype=object)
-    track_start_time = np.empty(nevents, dtype=object)
-    track_energy = np.empty(nevents, dtype=object)
-    track_start_position = np.empty(nevents, dtype=object)
-    track_stop_position = np.empty(nevents, dtype=object)
-    track_parent = np.empty(nevents, dtype=object)
-    track_flag = np.empty(nevents, dtype=object)
-
-    trigger_time = np.empty(nevents, dtype=object)
-    trigger_type = np.empty(nevents, dtype=object)
-
-    for ev in range(wcsim.nevent):
-        wcsim.get_event(ev)
-
-        event_info = wcsim.get_event_info()
-        pid[ev] = event_info["pid"]
-        position[ev] = event_info["position"]
-        direction[ev] = event_info["direction"]
-        energy[ev] = event_info["energy"]
-
-        true_hits = wcsim.get_hit_photons()
-        true_hit_pmt[ev] = true_hits["pmt"]
-        true_hit_time[ev] = true_hits["end_time"]
-        true_hit_pos[ev] = true_hits["end_position"]
-        true_hit_start_time[ev] = true_hits["start_time"]
-        true_hit_start_pos[ev] = true_hits["start_position"]
-        true_hit_parent[ev] = true_hits["track"]
-
-        digi_hits = wcsim.get_digitized_hits()
-        digi_hit_pmt[ev] = digi_hits["pmt"]
-        digi_hit_charge[ev] = digi_hits["charge"]
-        digi_hit_time[ev] = digi_hits["time"]
-        digi_hit_trigger[ev] = digi_hits["trigger"]
-
-        tracks = wcsim.get_tracks()
-        track_id[ev] = tracks["id"]
-        track_pid[ev] = tracks["pid"]
-        track_start_time[ev] = tracks["start_time"]
-        track_energy[ev] = tracks["energy"]
-        track_start_position[ev] = tracks["start_position"]
-        track_stop_position[ev] = tracks["stop_position"]
-        track_parent[ev] = tracks["parent"]
-        track_flag[ev] = tracks["flag"]
-
-        triggers = wcsim.get_triggers()
-        trigger_time[ev] = triggers["time"]
-        trigger_type[ev] = triggers["type"]
-
-        event_id[ev] = ev
-        root_file[ev] = infile
-
-    np.savez_compressed(outfile,
-                        event_id=event_id,
-                        root_file=root_file,
-                        pid=pid,
-                        position=position,
-                        direction=direction,
-                        energy=energy,
-                        digi_hit_pmt=digi_hit_pmt,
-                        digi_hit_charge=digi_hit_charge,
-                        digi_hit_time=digi_hit_time,
-                        digi_hit_trigger=digi_hit_trigger,
-                        true_hit_pmt=true_hit_pmt,
-                        true_hit_time=true_hit_time,
-                        true_hit_pos=true_hit_pos,
-                        true_hit_start_time=true_hit_start_time,
-                        true_hit_start_pos=true_hit_start_pos,
-                        true_hit_parent=true_hit_parent,
-                        track_id=track_id,
-                        track_pid=track_pid,
-                        track_start_time=track_start_time,
-                        track_energy=track_energy,
-                        track_start_position=track_start_position,
-                        track_stop_position=track_stop_position,
-                        track_parent=track_parent,
-                        track_flag=track_flag,
-                        trigger_time=trigger_time,
-                        trigger_type=trigger_type
-                        )
+# Groups of arrays that can be selected for output, each with the WCSim field it is read from and the names of its
+# output arrays with the corresponding key in that field
+FIELD_GROUPS = {
+    "info": ("event_info", {
+        "pid": "pid",
+        "position": "position",
+        "direction": "direction",
+        "energy": "energy"
+    }),
+    "digi": ("digitized_hits", {
+        "digi_hit_pmt": "pmt",
+        "digi_hit_charge": "charge",
+        "digi_hit_time": "time",
+        "digi_hit_trigger": "trigger"
+    }),
+    "truth": ("hit_photons", {
+        "true_hit_pmt": "pmt",
+        "true_hit_time": "end_time",
+        "true_hit_pos": "end_position",
+        "true_hit_start_time": "start_time",
+        "true_hit_start_pos": "start_position",
+        "true_hit_parent": "track"
+    }),
+    "tracks": ("tracks", {
+        "track_id": "id",
+        "track_pid": "pid",
+        "track_start_time": "start_time",
+        "track_energy": "energy",
+        "track_start_position": "start_position",
+        "track_stop_position": "stop_position",
+        "track_parent": "parent",
+        "track_flag": "flag"
+    }),
+    "triggers": ("triggers", {
+        "trigger_time": "time",
+        "trigger_type": "type"
+    })
+}
+
+
+def parse_fields(fields):
+    fields = [f.strip() for f in fields.split(',') if f.strip()]
+    for f in fields:
+        if f not in FIELD_GROUPS:
+            raise argparse.ArgumentTypeError("Unknown field group " + f + ", should be one of " + ','.join(FIELD_GROUPS))
+    return fields
+
+
+def dump_file(infile, outfile, columnar=False, start=0, stop=None, batch_size=1000, fields=tuple(FIELD_GROUPS),
+              flat=False):
+
+    if columnar:
+        wcsim = WCSimColumns(infile)
+    else:
+        wcsim = WCSimFile(infile)
+    if stop is None:
+        stop = wcsim.nevent
+    nevents = stop - start
+    groups = [g for g in FIELD_GROUPS if g in fields]
+
+    # All data arrays are initialized here, only for the requested field groups
+    # In the flat format, the per-event arrays are instead collected batch by batch and concatenated at the end
+    output = {
+        "event_id": np.empty(nevents, dtype=np.int32),
+        "root_file": np.full(nevents, infile) if flat else np.empty(nevents, dtype=object)
+    }
+    if "info" in groups:
+        output["pid"] = np.empty(nevents, dtype=np.int32)
+        output["position"] = np.empty((nevents, 3), dtype=np.float64)
+        output["direction"] = np.empty((nevents, 3), dtype=np.float64)
+        output["energy"] = np.empty(nevents, dtype=np.float64)
+    batches = {}
+    for group in groups:
+        if group != "info":
+            for name in FIELD_GROUPS[group][1]:
+                if flat:
+                    batches[name] = []
+                    batches[offsets_name(name)] = []
+                else:
+                    output[name] = np.empty(nevents, dtype=object)
+
+    # Only the WCSim fields of the requested groups are read, so the other getters are never called
+    wcsim_fields = [FIELD_GROUPS[g][0] for g in groups]
+    offset = 0
+    for batch in wcsim.iter_batches(fields=wcsim_fields, batch_size=batch_size, start=start, stop=stop):
+        offset_next = offset + len(batch["event_id"])
+        for group in groups:
+            field, names = FIELD_GROUPS[group]
+            data = batch[field]
+            for name, key in names.items():
+                if group == "info":
+                    output[name][offset:offset_next] = data[key]
+                elif flat:
+                    batches[name].append(data[key])
+                else:
+                    output[name][offset:offset_next] = split_by_event(data[key], data["event_offsets"])
+            if flat and group != "info":
+                batches[offsets_name(next(iter(names)))].append(data["event_offsets"])
+        output["event_id"][offset:offset_next] = batch["event_id"]
+        if not flat:
+            output["root_file"][offset:offset_next] = infile
+        offset = offset_next
+
+    if flat:
+        for name, parts in batches.items():
+            output[name] = concatenate_offsets(parts) if name in OFFSETS.values() else np.concatenate(parts)
+        save_flat(outfile, output)
+    else:
+        np.savez_compressed(outfile, **output)
     del wcsim
 
 
+def get_nevents(infile):
+    file = ROOT.TFile(infile, "read")
+    nevents = file.Get("wcsimT").GetEntries()
+    file.Close()
+    return nevents
+
+
+def merge_dumps(partial_files, outfile):
+    """Concatenate the npz files dumped from consecutive ranges of events of one ROOT file, then remove them"""
+    partials = [EventFile(f, mmap=False) for f in partial_files]
+    if partials[0].is_flat:
+        save_flat(outfile, {k: concatenate_offsets([p.npz[k] for p in partials]) if k in OFFSETS.values()
+                            else np.concatenate([p.npz[k] for p in partials]) for k in partials[0].files})
+    else:
+        np.savez_compressed(outfile, **{k: np.concatenate([p.npz[k] for p in partials]) for k in partials[0].files})
+    for p in partials:
+        p.close()
+    for f in partial_files:
+        os.remove(f)
+
+
+def dump_files_parallel(files, jobs, events_per_task=None, columnar=False, fields=tuple(FIELD_GROUPS), flat=False):
+    """
+    Dump a list of (input file, output file) pairs using a pool of worker processes. If events_per_task is given,
+    input files with more events are split into ranges of events that are dumped separately and merged afterwards.
+    """
+    tasks = []
+    partial_files = {}
+    for infile, outfile in files:
+        nevents = get_nevents(infile) if events_per_task is not None else None
+        if nevents is None or nevents <= events_per_task:
+            tasks.append((infile, outfile, 0, None, outfile))
+            continue
+        partial_files[outfile] = []
+        for start in range(0, nevents, events_per_task):
+            partial_file = os.path.splitext(outfile)[0] + "_part" + str(len(partial_files[outfile])) + ".npz"
+            partial_files[outfile].append(partial_file)
+            tasks.append((infile, partial_file, start, min(start + events_per_task, nevents), outfile))
+    remaining_parts = {outfile: len(parts) for outfile, parts in partial_files.items()}
+    file_count = len(files)
+    current_file = 0
+    # Use fresh worker processes rather than forking this one, since ROOT is not safe to fork; each worker loads
+    # libWCSimRoot once when it starts and keeps it for all the tasks it runs
+    with multiprocessing.get_context("spawn").Pool(jobs) as pool:
+        # each finished task puts its output file, whether it is a partial file, and any exception it raised
+        finished = queue.Queue()
+
+        def submit(function, args, kwargs, outfile, is_part):
+            pool.apply_async(function, args, kwargs, callback=lambda _: finished.put((outfile, is_part, None)),
+                             error_callback=lambda error: finished.put((outfile, is_part, error)))
+
+        for infile, task_file, start, stop, outfile in tasks:
+            submit(dump_file, (infile, task_file, columnar, start, stop), {"fields": fields, "flat": flat},
+                   outfile, task_file != outfile)
+        pending = len(tasks)
+        while pending:
+            outfile, is_part, error = finished.get()
+            pending -= 1
+            if error is not None:
+                raise error
+            if is_part:
+                remaining_parts[outfile] -= 1
+                if remaining_parts[outfile] == 0:
+                    submit(merge_dumps, (partial_files[outfile], outfile), {}, outfile, False)
+                    pending += 1
+                continue
+            current_file += 1
+            print("Finished converting file " + outfile + " (" + str(current_file) + "/" + str(file_count) + ")")
+
 if __name__ == '__main__':
 
     config = get_args()
@@ -145,9 +233,7 @@ if __name__ == '__main__':
     else:
         print("output directory not provided... output files will be in same locations as input files")
 
-    file_count = len(config.input_files)
-    current_file = 0
-
+    files = []
     for input_file in config.input_files:
         if os.path.splitext(input_file)[1].lower() != '.root':
             print("File " + input_file + " is not a .root file, skipping")
@@ -158,13 +244,22 @@ if __name__ == '__main__':
             output_file = os.path.splitext(input_file)[0] + '.npz'
         else:
             output_file = os.path.join(config.output_dir, os.path.splitext(os.path.basename(input_file))[0] + '.npz')
+        files.append((input_file, output_file))
+
+    if config.jobs > 1:
+        print("Converting", len(files), "files with", config.jobs, "worker processes")
+        dump_files_parallel(files, config.jobs, config.events_per_task, config.columnar, config.fields, config.flat)
+    else:
+        file_count = len(files)
+        current_file = 0
 
-        print("\nNow processing " + input_file)
-        print("Outputting to " + output_file)
+        for input_file, output_file in files:
+            print("\nNow processing " + input_file)
+            print("Outputting to " + output_file)
 
-        dump_file(input_file, output_file)
+            dump_file(input_file, output_file, config.columnar, fields=config.fields, flat=config.flat)
 
-        current_file += 1
-        print("Finished converting file " + output_file + " (" + str(current_file) + "/" + str(file_count) + ")")
+            current_file += 1
+            print("Finished converting file " + output_file + " (" + str(current_file) + "/" + str(file_count) + ")")
 
     print("\n=========== ALL FILES CONVERTED ===========\n")
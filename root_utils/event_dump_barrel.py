@@ -10,10 +10,12 @@ Authors: Wojtek Fedorko, Julian Ding, Nick Prouse
 
 import argparse
 from root_utils.root_file_utils import *
-from root_utils.pos_utils import *
+from root_utils.geometry import GEOMETRIES
 
 ROOT.gROOT.SetBatch(True)
 
+geometry = GEOMETRIES["iwcd"]
+
 
 def get_args():
     parser = argparse.ArgumentParser(description='dump WCSim data into numpy .npz file')
@@ -75,24 +77,18 @@ def dump_file(infile, outfile):
             np_q[i] = hit_q
             np_t[i] = hit_t
 
-        np_module_index = module_index(np_pmt_index)
-        np_pmt_in_module_id = pmt_in_module_id(np_pmt_index)
-
-        np_wall_indices = np.where(is_barrel(np_module_index))
+        np_wall_indices, np_wall_row, np_wall_col, np_pmt_in_module_id_wall = geometry.barrel_hits(np_pmt_index)
 
         np_q_wall = np_q[np_wall_indices]
         np_t_wall = np_t[np_wall_indices]
 
-        np_wall_row, np_wall_col = row_col(np_module_index[np_wall_indices])
-        np_pmt_in_module_id_wall = np_pmt_in_module_id[np_wall_indices]
-
-        np_wall_data_rect = np.zeros((16, 40, 38))
+        np_wall_data_rect = np.zeros(geometry.grid_shape)
         np_wall_data_rect[np_wall_row,
                           np_wall_col,
                           np_pmt_in_module_id_wall] = np_q_wall
         np_wall_data_rect[np_wall_row,
                           np_wall_col,
-                          np_pmt_in_module_id_wall + 19] = np_t_wall
+                          np_pmt_in_module_id_wall + geometry.pmts_per_module] = np_t_wall
 
         np_wall_data_rect_ev = np.expand_dims(np_wall_data_rect, axis=0)
 
@@ -0,0 +1,167 @@
+"""
+Vectorized calculations over many events at once, on flat arrays of hits, tracks and triggers with offsets arrays
+giving the boundaries of each event (event i has values [offsets[i], offsets[i+1]))
+"""
+
+import numpy as np
+
+label_map = {22: 0, 11: 1, 13: 2, 111: 3}
+
+
+def offsets_from_counts(counts):
+    """Returns the boundaries of consecutive segments with the given counts, starting at 0, as an int64 array"""
+    offsets = np.zeros(len(counts)+1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def event_index(offsets):
+    """Returns the event number of each value in a flat array, given the boundaries of each event"""
+    return np.repeat(np.arange(len(offsets)-1), np.diff(offsets))
+
+
+def segment_any(values, offsets):
+    """Returns for each event whether any of its values are True"""
+    counts = np.diff(offsets)
+    result = np.zeros(len(counts), dtype=bool)
+    non_empty = counts > 0
+    if np.any(non_empty):
+        # reduceat gives the wrong result for empty segments, so only reduce over the non-empty ones
+        result[non_empty] = np.logical_or.reduceat(values, offsets[:-1][non_empty])
+    return result
+
+
+def get_labels(pids, labels=None):
+    """Returns the label of each event given the pid of its particle, or -1 for pids that have no label"""
+    if labels is None:
+        labels = label_map
+    result = np.full(len(pids), -1, dtype=np.int32)
+    for pid, label in labels.items():
+        result[pids == pid] = label
+    return result
+
+
+def get_angles(directions):
+    """Returns the polar and azimuthal angle of each event's direction, with the y-axis as the polar axis"""
+    polars = np.arccos(directions[:, 1])
+    azimuths = np.arctan2(directions[:, 2], directions[:, 0])
+    return np.stack((polars, azimuths), axis=1)
+
+
+def get_veto(track_pid, track_energy, track_start_position, track_stop_position, track_offsets,
+             radius=400, half_height=300):
+    """
+    Returns two flags for each event, whether any track above threshold leaves the tank (veto) and whether any track
+    would still be above threshold when leaving the tank, estimating its energy loss as 2 MeV/cm (veto2)
+    """
+    abs_pid = np.abs(track_pid)
+    outside_tank = ((np.linalg.norm(track_stop_position[:, (0, 2)], axis=1) > radius)
+                    | (np.abs(track_stop_position[:, 1]) > half_height))
+    end_energy_estimate = track_energy - np.linalg.norm(track_stop_position - track_start_position, axis=1)*2
+    veto = []
+    for energy in (track_energy, end_energy_estimate):
+        above_threshold = (((abs_pid == 13) & (energy > 166))
+                           | ((abs_pid == 11) & (energy > 2))
+                           | ((abs_pid == 22) & (energy > 2)))
+        veto.append(segment_any(above_threshold & outside_tank, track_offsets))
+    return veto[0], veto[1]
+
+
+def get_event_info(npz_file, radius=400, half_height=300):
+    """
+    Returns the per-event values of an event_dump.py output file that do not depend on its hits, as a dictionary of
+    arrays with one value per event: the event_id, root_file, pid, energy, position and direction read from the file,
+    and the angles and veto flags calculated from them and the tracks
+    """
+    event_info = {name: npz_file[name] for name in ("event_id", "root_file", "pid", "energy", "position", "direction")}
+    event_info["angles"] = get_angles(event_info["direction"])
+    event_info["veto"], event_info["veto2"] = get_veto(
+        npz_file.values('track_pid'), npz_file.values('track_energy'), npz_file.values('track_start_position'),
+        npz_file.values('track_stop_position'), npz_file.offsets('track_pid'), radius, half_height)
+    return event_info
+
+
+def first_trigger_indices(trigger_times, event_offsets, selected=None):
+    """
+    Returns the index within each event of its earliest trigger, only considering triggers where `selected` is True if
+    it is given, or -1 for events without any such trigger
+    """
+    n_events = len(event_offsets) - 1
+    trigger_event = event_index(event_offsets)
+    if selected is None:
+        selected = np.ones(len(trigger_times), dtype=bool)
+    # sorting by event, then selected triggers first, then by time puts each event's earliest selected trigger at
+    # the start of its segment (the sort is stable, so the first of equal times is kept as with np.argmin)
+    order = np.lexsort((trigger_times, ~selected, trigger_event))
+    first_trigger = np.full(n_events, -1, dtype=np.int64)
+    has_trigger = np.flatnonzero(np.diff(event_offsets) > 0)
+    first = order[event_offsets[has_trigger]]
+    found = selected[first]
+    first_trigger[has_trigger[found]] = first[found] - event_offsets[has_trigger[found]]
+    return first_trigger
+
+
+def select_trigger_hits(hit_trigger, hit_offsets, event_triggers, min_hits=1):
+    """
+    Returns a mask of the hits that belong to each event's chosen trigger, and the number of selected hits of each
+    event, keeping no hits for events without a chosen trigger (-1) or with fewer than min_hits hits in it
+    """
+    hit_event = event_index(hit_offsets)
+    selected = hit_trigger == event_triggers[hit_event]
+    n_hits = np.bincount(hit_event[selected], minlength=len(event_triggers))
+    if min_hits > 1:
+        selected &= n_hits[hit_event] >= min_hits
+        n_hits[n_hits < min_hits] = 0
+    return selected, n_hits
+
+
+def segment_common_value(values, offsets, mixed=-2):
+    """
+    Returns for each segment the value shared by all of its values, or `mixed` for segments with differing values or
+    no values at all
+    """
+    counts = np.diff(offsets)
+    result = np.full(len(counts), mixed, dtype=values.dtype)
+    non_empty = counts > 0
+    if np.any(non_empty):
+        starts = offsets[:-1][non_empty]
+        minimum = np.minimum.reduceat(values, starts)
+        maximum = np.maximum.reduceat(values, starts)
+        result[non_empty] = np.where(minimum == maximum, minimum, mixed)
+    return result
+
+
+def first_trigger_hit_selection(npz_file):
+    """
+    Returns the indices of the digitized hits of an npz file that belong to their event's earliest trigger (of any
+    type), in the flat hit arrays, and the event number of each of them
+    """
+    hit_offsets = npz_file.offsets('digi_hit_trigger')
+    event_triggers = first_trigger_indices(npz_file.values('trigger_time'), npz_file.offsets('trigger_time'))
+    hit_event = event_index(hit_offsets)
+    hits = np.flatnonzero(npz_file.values('digi_hit_trigger') == event_triggers[hit_event])
+    return hits, hit_event[hits]
+
+
+def grid_blocks(n_events, hit_event, fields, shape, block_size):
+    """
+    Yields the grids of blocks of up to block_size consecutive events, as float32 arrays of shape (events,) + shape,
+    filled by scattering the values of hits sorted by event, whose event numbers are given by hit_event. fields is a
+    list of (indices, values) pairs, where indices is a tuple of index arrays into the grid of each hit's event. As for
+    numpy assignment, the last of several hits at the same position is kept.
+    """
+    block_starts = np.arange(0, n_events, block_size)
+    block_hits = np.searchsorted(hit_event, np.append(block_starts, n_events))
+    for i, start in enumerate(block_starts):
+        stop = min(start + block_size, n_events)
+        hits = slice(block_hits[i], block_hits[i+1])
+        grids = np.zeros((stop - start,) + tuple(shape), dtype=np.float32)
+        event = hit_event[hits] - start
+        for indices, values in fields:
+            grids[(event,) + tuple(index[hits] for index in indices)] = values[hits]
+        yield grids
+
+
+def block_size_for(shape, buffer_mb):
+    """The number of float32 grids of the given shape that fit in buffer_mb MB, for converting in blocks"""
+    return max(1, int(buffer_mb * (1 << 20)) // (4 * int(np.prod(shape))))
@@ -0,0 +1,138 @@
+"""
+Utilities for reading the .npz files written by event_dump.py, in either of its two formats
+
+The default format stores each per-event array (hits, photons, tracks and triggers) as an object array holding one
+array per event, which has to be unpickled. The flat format (event_dump.py --flat) instead stores each of them as one
+typed array of all events' values, with an int64 offsets array for each group of arrays giving the boundaries of each
+event, i.e. event i has values [offsets[i], offsets[i+1]). Flat files are saved uncompressed so that their arrays can be
+memory-mapped directly from the .npz file and sliced without reading the rest of the file.
+"""
+
+import struct
+import zipfile
+
+import numpy as np
+
+# The offsets array of each group of per-event arrays, keyed by the prefix of the arrays' names
+OFFSETS = {
+    "digi_hit_": "digi_hit_offsets",
+    "true_hit_": "true_hit_offsets",
+    "track_": "track_offsets",
+    "trigger_": "trigger_offsets"
+}
+
+# Endings of the names of per-event arrays that hold a position, i.e. three values for each hit, photon or track
+POSITION_SUFFIXES = ("_pos", "_position")
+
+
+def offsets_name(name):
+    """Returns the name of the offsets array of a per-event array, or None if it is not a per-event array"""
+    if name in OFFSETS.values():
+        return None
+    for prefix, offsets in OFFSETS.items():
+        if name.startswith(prefix):
+            return offsets
+    return None
+
+
+def concatenate_offsets(offsets_list):
+    """Join offsets arrays of consecutive parts into one, shifting each by the total length of the parts before it"""
+    shifts = np.cumsum([0] + [o[-1] for o in offsets_list])
+    return np.concatenate([o[:-1] + s for o, s in zip(offsets_list, shifts)] + [shifts[-1:]]).astype(np.int64)
+
+
+def split_by_event(values, event_offsets):
+    """Split a flat array into an object array of per-event arrays, given the boundaries of each event"""
+    split = np.empty(len(event_offsets)-1, dtype=object)
+    for i in range(len(split)):
+        split[i] = values[event_offsets[i]:event_offsets[i+1]]
+    return split
+
+
+def save_flat(outfile, arrays):
+    """Save a dictionary of flat arrays and offsets to an uncompressed .npz file that can be memory-mapped"""
+    np.savez(outfile, **arrays)
+
+
+def memmap_npz_array(path, name):
+    """Memory-map an array stored uncompressed in an .npz file, or load it normally if it is compressed"""
+    with zipfile.ZipFile(path) as npz:
+        info = npz.getinfo(name + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        return np.load(path)[name]
+    with open(path, "rb") as f:
+        # skip the zip local file header to get to the .npy data, then read the .npy header
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack("<HH", f.read(4))
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if dtype.hasobject:
+        raise ValueError("Array " + name + " in " + path + " holds python objects and cannot be memory-mapped")
+    if np.prod(shape) == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape, order="F" if fortran_order else "C")
+
+
+class EventFile:
+    """
+    Read access to an event_dump.py output file in either format. Indexing by name returns the same arrays as the
+    default format, i.e. an object array of per-event arrays for hits, photons, tracks and triggers. The values() and
+    offsets() methods give the flat array and event boundaries of a per-event array, for either format.
+    """
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.npz = np.load(path, allow_pickle=True)
+        self.files = self.npz.files
+        self.is_flat = any(o in self.files for o in OFFSETS.values())
+        self.mmap = mmap and self.is_flat
+        self.arrays = {}
+
+    def __contains__(self, name):
+        return name in self.files
+
+    def _load(self, name):
+        if name not in self.arrays:
+            if self.mmap:
+                self.arrays[name] = memmap_npz_array(self.path, name)
+            else:
+                self.arrays[name] = self.npz[name]
+        return self.arrays[name]
+
+    def __getitem__(self, name):
+        if self.is_flat and offsets_name(name) is not None:
+            return split_by_event(self._load(name), self.offsets(name))
+        array = self._load(name)
+        if array.dtype.kind == "U":  # strings are stored as fixed width in the flat format
+            return array.astype(object)
+        return array
+
+    def values(self, name):
+        """Returns the values of a per-event array for all events concatenated into one array"""
+        if self.is_flat:
+            return self._load(name)
+        events = self._load(name)
+        # events without any values, e.g. without tracks, may be stored with shape (0,) in older files, even for
+        # positions of shape (n, 3), so they are given the shape and type of the other events' values
+        values = next((e for e in events if len(e) > 0), None)
+        if values is None:
+            return np.empty((0, 3) if name.endswith(POSITION_SUFFIXES) else 0)
+        empty = np.empty((0,) + values.shape[1:], dtype=values.dtype)
+        return np.concatenate([empty if len(e) == 0 else e for e in events])
+
+    def offsets(self, name):
+        """Returns the boundaries of each event's values of a per-event array, in the array given by values(name)"""
+        if self.is_flat:
+            return np.asarray(self._load(offsets_name(name)))
+        counts = [len(e) for e in self._load(name)]
+        offsets = np.zeros(len(counts)+1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return offsets
+
+    def close(self):
+        self.arrays = {}
+        self.npz.close()
@@ -0,0 +1,139 @@
+"""
+Registry of the detectors whose barrel PMTs are arranged into the rectangular grids of the grid converters and event
+displays, with lookup tables from PMT number to the PMT's region, row and column in the barrel grid and channel within
+its module, built once when this module is imported
+
+PMT numbers start at 0 (WCSim tube id - 1). For mPMT detectors, each 19 consecutive PMTs belong to one module, so the
+module number is pmt // 19 and pmt % 19 is the position in the module: 1-12 is the outer ring, 13-18 is the inner ring,
+0 is the centre PMT. For detectors of single PMTs, each PMT is its own module.
+
+The modules of the IWCD and HyperK mPMT detectors are numbered starting with the second highest ring around the barrel,
+then going down ring by ring to the lowest ring, then one of the end-caps, then the highest ring around the barrel that
+was skipped before, then the other end-cap. HyperK single PMTs are numbered three rows of the barrel at a time, going
+round the barrel column by column, starting from the fourth highest row, and the bottom three rows are in reverse order,
+then the top end-cap, then the highest three rows of the barrel, then the bottom end-cap.
+
+Rows of the barrel grid are numbered from the bottom of the barrel. Positions in a grid of charge and time have the
+charge of channel c at c and its time at c + pmts_per_module.
+"""
+
+import numpy as np
+
+# Regions of the detector in the lookup tables, which give -1 for PMTs that are not in any region
+BARREL = 0
+BOTTOM = 1
+TOP = 2
+
+
+class Geometry:
+    """
+    Lookup tables of a detector, built from its description:
+        pmts_per_module: number of PMTs in each module (19 for mPMTs, 1 for single PMTs)
+        barrel_shape:    number of rows and columns of modules in the barrel
+        regions:         list of (region, first module, stop module) for ranges of consecutive module numbers
+        barrel_order:    the module at each position of the barrel, row by row starting from the top of the barrel
+        grid_window:     (shift, number of columns) of the window of barrel columns kept in the grids of the grid
+                         converters, after rotating the barrel by shift columns, or None to keep the whole barrel
+    table has one row per PMT of its region, row, column and channel, and module_table one row per module of its region,
+    row and column, with -1 as the row and column of modules outside the barrel. column_map gives the column in the
+    window of each barrel column, or -1 outside the window, and is None if the whole barrel is kept.
+    """
+    def __init__(self, name, pmts_per_module, barrel_shape, regions, barrel_order, grid_window=None):
+        self.name = name
+        self.pmts_per_module = pmts_per_module
+        self.barrel_shape = tuple(barrel_shape)
+        n_modules = max(stop for _, _, stop in regions)
+        self.module_table = np.full((n_modules, 3), -1, dtype=np.int32)
+        for region, first, stop in regions:
+            self.module_table[first:stop, 0] = region
+        rows, columns = self.barrel_shape
+        position = np.arange(rows*columns)
+        self.module_table[barrel_order, 1] = rows - 1 - position // columns
+        self.module_table[barrel_order, 2] = position % columns
+        pmts = np.arange(n_modules*pmts_per_module)
+        self.table = np.empty((len(pmts), 4), dtype=np.int32)
+        self.table[:, :3] = self.module_table[pmts // pmts_per_module]
+        self.table[:, 3] = pmts % pmts_per_module
+        self.n_pmts = len(pmts)
+        self.grid_window = grid_window
+        self.column_map = None if grid_window is None else self.column_window(*grid_window)
+
+    @property
+    def grid_shape(self):
+        """Shape of the grid of the charge and time of each PMT in the barrel"""
+        return self.barrel_shape + (2*self.pmts_per_module,)
+
+    @property
+    def window_shape(self):
+        """Shape of the grids of the grid converters, of the charge and time of each PMT in the window of the barrel"""
+        if self.grid_window is None:
+            return self.grid_shape
+        return (self.barrel_shape[0], self.grid_window[1], 2*self.pmts_per_module)
+
+    def lookup(self, pmts):
+        """Returns the region, row, column and channel of each PMT, as the columns of an int32 array"""
+        return self.table[pmts]
+
+    def barrel_hits(self, pmts, column_map=None):
+        """
+        Returns the indices of the PMTs in the barrel, in the given array of PMT numbers of hits, and their row, column
+        and channel. If column_map is given, as returned by column_window(), the columns are mapped through it and PMTs
+        in columns outside the window are left out.
+        """
+        pmt_table = self.table[pmts]
+        barrel = pmt_table[:, 0] == BARREL
+        if column_map is not None:
+            columns = column_map[pmt_table[:, 2]]
+            barrel &= columns >= 0
+            pmt_table[:, 2] = columns
+        barrel = np.flatnonzero(barrel)
+        barrel_table = pmt_table[barrel]
+        return barrel, barrel_table[:, 1], barrel_table[:, 2], barrel_table[:, 3]
+
+    def column_window(self, shift, n_columns):
+        """
+        Returns the column of each barrel column in a window of n_columns columns of the barrel after rotating it by
+        shift columns, i.e. the columns kept by np.roll(grid, shift, axis=1)[:, :n_columns], or -1 outside the window
+        """
+        columns = (np.arange(self.barrel_shape[1]) + shift) % self.barrel_shape[1]
+        return np.where(columns < n_columns, columns, -1).astype(np.int32)
+
+    def module_region(self, modules):
+        """Returns the region of each module, or -1 for module numbers outside the detector"""
+        modules = np.asarray(modules)
+        in_range = (modules >= 0) & (modules < len(self.module_table))
+        return np.where(in_range, self.module_table[np.where(in_range, modules, 0), 0], -1)
+
+
+def mpmt_barrel_order(top_row, bulk):
+    """Barrel order of mPMT modules, given the (first, stop) module numbers of the highest ring and the other rings"""
+    return np.concatenate((np.arange(*top_row), np.arange(*bulk)))
+
+
+def hyperk_barrel_order():
+    """Barrel order of the HyperK single PMTs, which are numbered three rows at a time"""
+    barrel_pmts = np.concatenate((np.arange(0, 22464), np.arange(29988, 30924)))
+    bulk = barrel_pmts < 21528
+    top = barrel_pmts >= 29988
+    bottom = ~bulk & ~top
+    local_pmts = np.where(top, barrel_pmts - 29988, barrel_pmts)
+    three_row_index = np.where(bulk, local_pmts // 936 + 1, np.where(top, 0, 24))
+    # the rows of the bottom three rows are in reverse order
+    row_in_3rows = np.where(bottom, (2 - local_pmts) % 3, local_pmts % 3)
+    column = (local_pmts // 3) % 312
+    order = np.empty(len(barrel_pmts), dtype=np.int64)
+    order[312*(3*three_row_index + row_in_3rows) + column] = barrel_pmts
+    return order
+
+
+GEOMETRIES = {
+    "iwcd": Geometry("iwcd", 19, (16, 40),
+                     [(BARREL, 0, 600), (BOTTOM, 600, 696), (BARREL, 696, 736), (TOP, 736, 832)],
+                     mpmt_barrel_order((696, 736), (0, 600))),
+    "hyperk": Geometry("hyperk", 1, (75, 312),
+                       [(BARREL, 0, 22464), (TOP, 22464, 29988), (BARREL, 29988, 30924), (BOTTOM, 30924, 38448)],
+                       hyperk_barrel_order(), grid_window=(37, 75)),
+    "hyperk_mpmt": Geometry("hyperk_mpmt", 19, (27, 110),
+                            [(BARREL, 0, 2860), (TOP, 2860, 3812), (BARREL, 3812, 3922), (BOTTOM, 3922, 4874)],
+                            mpmt_barrel_order((3812, 3922), (0, 2860)), grid_window=(13, 27))
+}
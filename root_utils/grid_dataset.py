@@ -0,0 +1,171 @@
+"""
+Reader for the grid hdf5 files written by np_to_grid_hdf5.py, np_to_grid_hdf5_hyperk.py, np_to_grid_hdf5_hyperk_mpmt.py
+and np_to_hdf5.py, in either the dense layout or the sparse layout written with --sparse
+
+Dense files hold the grid of each event in event_data. Sparse files store only the non-zero cells of each event's grid,
+with grid_cell giving the index of each cell in the flattened grid and grid_value its value, and event_grid_index giving
+the index of each event's first cell. GridDataset returns the grids of either layout as the same dense arrays, filling
+the grids of a batch of events in one preallocated array.
+
+HitGridDataset instead builds the grids of a batch of events from a hit array file, such as one written by
+np_to_digihit_array_hdf5.py, when they are read, so that no grid file needs to be stored. hits_to_grids() does the same
+for any batch of hits, e.g. the ranges of hits of a trigger selection read with HitArrayDataset.get_hit_ranges().
+"""
+
+import h5py
+import numpy as np
+
+from root_utils.event_utils import offsets_from_counts, event_index
+from root_utils.hit_array_dataset import HitArrayDataset, memmap_dataset, read_ranges
+from root_utils.geometry import GEOMETRIES
+
+# Datasets of the grids themselves, in either layout, rather than of per-event values
+GRID_NAMES = ("event_data", "event_grid_index", "grid_cell", "grid_value")
+
+
+def grid_buffer(n_events, grid_shape, out=None):
+    """
+    Returns an array for the grids of n_events events: the first rows of out if it is given, which must be a
+    C-contiguous float32 array of grids of shape grid_shape with room for at least that many grids, or a new array
+    """
+    if out is None:
+        return np.empty((n_events,) + tuple(grid_shape), dtype=np.float32)
+    if (not out.flags.c_contiguous or out.dtype != np.float32 or out.shape[1:] != tuple(grid_shape)
+            or len(out) < n_events):
+        raise ValueError("out must be a C-contiguous float32 array of at least {} grids of shape {}"
+                         .format(n_events, tuple(grid_shape)))
+    return out[:n_events]
+
+
+def hits_to_grids(hit_offsets, hit_pmt, hit_charge, hit_time, geometry, out=None):
+    """
+    Returns the grids of the charge and time of a batch of events' hits, in the same layout as the grids of the grid
+    converters, i.e. of the geometry's window of barrel columns, as one float32 array of shape
+    (events,) + geometry.window_shape, given the concatenated hits of the events and hit_offsets, the boundaries of each
+    event's hits. If out is given, the grids are filled into its first rows, as for GridDataset.get_grids().
+    """
+    grids = grid_buffer(len(hit_offsets) - 1, geometry.window_shape, out)
+    grids.fill(0)
+    barrel, row, col, channel = geometry.barrel_hits(hit_pmt, geometry.column_map)
+    event = event_index(hit_offsets)[barrel]
+    grids[event, row, col, channel] = hit_charge[barrel]
+    grids[event, row, col, channel + geometry.pmts_per_module] = hit_time[barrel]
+    return grids
+
+
+class GridDataset:
+    """
+    Random access to the events of a grid file. Indexing with an event number returns a dictionary of that event's
+    grid, as "event_data", and its values of the per-event datasets. get_batch() does the same for a list of events at
+    once, with their grids in one array.
+    """
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.file = h5py.File(path, "r")
+        self.sparse = "event_data" not in self.file
+        self.event_names = [n for n in self.file if n not in GRID_NAMES]
+        self.event_arrays = {}
+        if self.sparse:
+            self.grid_shape = tuple(int(n) for n in self.file["grid_cell"].attrs["grid_shape"])
+            n_cells = self.file["grid_value"].shape[0]
+            # boundaries of each event's cells, event i has cells [offsets[i], offsets[i+1])
+            self.offsets = np.append(self.file["event_grid_index"][()], n_cells).astype(np.int64)
+            self.n_events = len(self.offsets) - 1
+            names = ("grid_cell", "grid_value")
+        else:
+            self.grid_shape = self.file["event_data"].shape[1:]
+            self.n_events = self.file["event_data"].shape[0]
+            names = ("event_data",)
+        self.grids = {}
+        for name in names:
+            dset = self.file[name]
+            array = memmap_dataset(path, dset) if mmap else None
+            self.grids[name] = array if array is not None else dset
+
+    def __len__(self):
+        return self.n_events
+
+    def close(self):
+        self.grids = {}
+        self.event_arrays = {}
+        self.file.close()
+
+    def event_array(self, name):
+        """Returns a per-event dataset, read into memory on first use"""
+        if name not in self.event_arrays:
+            self.event_arrays[name] = self.file[name][()]
+        return self.event_arrays[name]
+
+    def __getitem__(self, event):
+        result = {"event_data": self.get_grids([event])[0]}
+        for name in self.event_names:
+            result[name] = self.event_array(name)[event]
+        return result
+
+    def get_batch(self, events, out=None):
+        """
+        Returns the grids of a list of events as "event_data", filled into out if it is given, and the per-event
+        datasets for those events
+        """
+        events = np.asarray(events, dtype=np.int64)
+        result = {"event_data": self.get_grids(events, out)}
+        for name in self.event_names:
+            result[name] = self.event_array(name)[events]
+        return result
+
+    def get_grids(self, events, out=None):
+        """
+        Returns the grids of a list of events as one float32 array of shape (events,) + grid_shape. If out is given, a
+        C-contiguous float32 array with room for at least that many grids, the grids are filled into its first rows,
+        which are returned, so that one buffer can be reused for every batch.
+        """
+        events = np.asarray(events, dtype=np.int64)
+        grids = grid_buffer(len(events), self.grid_shape, out)
+        if not self.sparse:
+            event_data = self.grids["event_data"]
+            if isinstance(event_data, np.ndarray):
+                np.take(event_data, events, axis=0, out=grids)
+            else:  # h5py only reads increasing, distinct indices
+                unique_events, inverse = np.unique(events, return_inverse=True)
+                grids[...] = event_data[unique_events][inverse]
+            return grids
+        starts = self.offsets[events]
+        counts = self.offsets[events+1] - starts
+        cell_offsets = offsets_from_counts(counts)
+        cells = {}
+        for name, array in self.grids.items():
+            if isinstance(array, np.ndarray):
+                cells[name] = array[np.repeat(starts - cell_offsets[:-1], counts) + np.arange(cell_offsets[-1])]
+            else:
+                cells[name] = read_ranges(array, starts, cell_offsets)
+        grids.fill(0)
+        grids.reshape(len(events), -1)[event_index(cell_offsets), cells["grid_cell"]] = cells["grid_value"]
+        return grids
+
+
+class HitGridDataset(HitArrayDataset):
+    """
+    A HitArrayDataset whose get_grids() and get_batch() build the grids of the events from their hits, in the same
+    layout as the grid converter of the given geometry writes them, including its window of barrel columns. Indexing
+    with an event number and get_batch() return the same dictionary as GridDataset, with the grids as "event_data",
+    along with the hits.
+    """
+    def __init__(self, path, geometry="iwcd", mmap=True):
+        super().__init__(path, mmap)
+        self.geometry = GEOMETRIES[geometry]
+        self.grid_shape = self.geometry.window_shape
+
+    def __getitem__(self, event):
+        result = super().__getitem__(event)
+        result["event_data"] = self.get_grids([event])[0]
+        return result
+
+    def get_grids(self, events, out=None):
+        """Returns the grids of a list of events, filled into out if it is given, as for GridDataset.get_grids()"""
+        return self.get_batch(events, out)["event_data"]
+
+    def get_batch(self, events, out=None):
+        batch = super().get_batch(events)
+        batch["event_data"] = hits_to_grids(batch["hit_offsets"], batch["pmt"], batch["charge"], batch["time"],
+                                            self.geometry, out)
+        return batch
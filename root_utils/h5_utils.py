@@ -0,0 +1,385 @@
+"""
+Helpers for writing the WatChMaL HDF5 files when the number of events and hits is not known in advance
+"""
+
+import os
+import hashlib
+import multiprocessing
+import numpy as np
+import h5py
+
+# Index datasets giving the position of each event's or trigger's first row in another dataset, keyed by name with the
+# dataset they index, whose values must be shifted when files are concatenated
+INDEX_DATASETS = {
+    "event_hits_index": "hit_pmt",
+    "event_triggers_index": "trigger_time",
+    "trigger_hits_index": "hit_pmt",
+    "event_grid_index": "grid_value"
+}
+
+# Target size in bytes of each chunk of resizable datasets
+chunk_bytes = 1 << 20
+
+# Named storage layouts for the output datasets, selectable with --profile on each writer:
+#   fast-read: uncompressed and contiguous. Datasets whose size is not known in advance are written in chunks of up to
+#              chunk_bytes, then copied into contiguous datasets by relayout_contiguous() once the file is finished
+#   balanced:  small chunks compressed with lzf after byte shuffling, cheap to decompress for single events
+#   archive:   larger chunks compressed with gzip, for the smallest files
+# Hits are read one event at a time as the slice given by event_hits_index, usually hundreds to a few thousand hits,
+# so compressed chunks are kept small enough that reading an event only decompresses one or two chunks per dataset
+STORAGE_PROFILES = {
+    "fast-read": {"chunk_bytes": None},
+    "balanced": {"chunk_bytes": 1 << 16, "compression": "lzf", "shuffle": True},
+    "archive": {"chunk_bytes": 1 << 18, "compression": "gzip", "compression_opts": 6, "shuffle": True}
+}
+
+
+def storage_options(profile, shape, dtype, resizable=False):
+    """
+    Returns the create_dataset keyword arguments of a storage profile for a dataset of the given total shape, which
+    can be extended along its first axis if resizable
+    """
+    settings = dict(STORAGE_PROFILES[profile])
+    target_bytes = settings.pop("chunk_bytes")
+    if target_bytes is None:
+        if not resizable:
+            return {}
+        target_bytes = chunk_bytes
+    if not resizable and shape[0] == 0:  # chunks cannot be larger than a fixed size dataset
+        return {}
+    row_bytes = max(1, int(np.prod(shape[1:])) * np.dtype(dtype).itemsize)
+    chunk_rows = max(1, target_bytes // row_bytes)
+    if not resizable:
+        chunk_rows = min(chunk_rows, shape[0])
+    options = {"chunks": (chunk_rows,) + tuple(shape[1:])}
+    options.update(settings)
+    return options
+
+
+def create_dataset(f, name, shape, dtype, profile="fast-read"):
+    """Create a dataset of fixed shape using the layout of a storage profile"""
+    return f.create_dataset(name, shape=shape, dtype=dtype, **storage_options(profile, shape, dtype))
+
+
+def create_resizable_dataset(f, name, shape, dtype, profile="fast-read"):
+    """
+    Create an empty dataset that can be extended along its first axis, where shape is the shape of each row
+    (e.g. () for one value per event or hit, (1, 3) for positions)
+    """
+    full_shape = (0,) + tuple(shape)
+    return f.create_dataset(name, shape=full_shape, maxshape=(None,) + tuple(shape), dtype=dtype,
+                            **storage_options(profile, full_shape, dtype, resizable=True))
+
+
+class BufferedWriter:
+    """
+    Writes rows to consecutive positions of a dataset, starting at `start`, keeping them in memory until about
+    buffer_mb MB have accumulated and then writing them as one contiguous block. Resizable datasets are extended as
+    needed. flush() must be called after the last rows are written.
+    """
+    def __init__(self, dset, start=0, buffer_mb=64):
+        self.dset = dset
+        self.position = start
+        self.buffer_bytes = int(buffer_mb * (1 << 20))
+        self.buffer = []
+        self.buffered_rows = 0
+        self.buffered_bytes = 0
+
+    @property
+    def size(self):
+        """Position in the dataset after all rows written so far, including those not yet flushed"""
+        return self.position + self.buffered_rows
+
+    def write(self, rows):
+        """Write an array of rows, i.e. an array whose first axis runs over the rows to add"""
+        rows = np.asarray(rows)
+        if len(rows) == 0:
+            return
+        self.buffer.append(rows)
+        self.buffered_rows += len(rows)
+        self.buffered_bytes += rows.nbytes
+        if self.buffered_bytes >= self.buffer_bytes:
+            self.flush()
+
+    def write_row(self, row):
+        """Write a single row"""
+        self.write(np.expand_dims(row, 0))
+
+    def flush(self):
+        if not self.buffer:
+            return
+        block = np.concatenate(self.buffer) if len(self.buffer) > 1 else self.buffer[0]
+        stop = self.position + len(block)
+        resizable = self.dset.maxshape[0] is None
+        if resizable and self.dset.shape[0] == 0 and self.dset.chunks[0] > len(block):
+            # the first block shows how much data there is, so small datasets do not get chunks much larger than them
+            self.dset = rechunk_empty(self.dset, len(block))
+        if resizable and stop > self.dset.shape[0]:
+            self.dset.resize(stop, axis=0)
+        self.dset[self.position:stop] = block
+        self.position = stop
+        self.buffer = []
+        self.buffered_rows = 0
+        self.buffered_bytes = 0
+
+
+def rechunk_empty(dset, chunk_rows):
+    """
+    Recreate an empty resizable dataset with chunks of chunk_rows rows, keeping its other settings and attributes, and
+    return the new dataset, which replaces the given one
+    """
+    parent, name, attrs = dset.parent, dset.name, dict(dset.attrs)
+    options = {"shape": dset.shape, "maxshape": dset.maxshape, "dtype": dset.dtype,
+               "chunks": (chunk_rows,) + dset.chunks[1:], "compression": dset.compression,
+               "compression_opts": dset.compression_opts, "shuffle": dset.shuffle}
+    del parent[name]
+    dset = parent.create_dataset(name, **options)
+    dset.attrs.update(attrs)
+    return dset
+
+
+def buffered_writers(datasets, buffer_mb=64):
+    """Wrap a dictionary of resizable datasets in BufferedWriters appending to the end of each dataset"""
+    return {name: BufferedWriter(dset, dset.shape[0], buffer_mb) for name, dset in datasets.items()}
+
+
+def flush_all(writers):
+    for writer in writers.values():
+        writer.flush()
+
+
+def create_digihit_datasets(f, profile="fast-read", all_triggers=False):
+    """
+    Create the empty resizable datasets of a digitized hit array file, returning them in a dictionary by name. With
+    all_triggers, the hits of all triggers are kept with a hit_trigger column, and trigger tables are added: the time
+    and type of each trigger, the index of each event's first trigger and the index of each trigger's first hit.
+    """
+    datasets = {
+        "labels": create_resizable_dataset(f, "labels", (), np.int32, profile),
+        "root_files": create_resizable_dataset(f, "root_files", (), h5py.special_dtype(vlen=str), profile),
+        "event_ids": create_resizable_dataset(f, "event_ids", (), np.int32, profile),
+        "hit_time": create_resizable_dataset(f, "hit_time", (), np.float32, profile),
+        "hit_charge": create_resizable_dataset(f, "hit_charge", (), np.float32, profile),
+        "hit_pmt": create_resizable_dataset(f, "hit_pmt", (), np.int32, profile),
+        "event_hits_index": create_resizable_dataset(f, "event_hits_index", (), np.int64, profile),
+        "energies": create_resizable_dataset(f, "energies", (1,), np.float32, profile),
+        "positions": create_resizable_dataset(f, "positions", (1, 3), np.float32, profile),
+        "angles": create_resizable_dataset(f, "angles", (2,), np.float32, profile),
+        "veto": create_resizable_dataset(f, "veto", (), np.bool_, profile),
+        "veto2": create_resizable_dataset(f, "veto2", (), np.bool_, profile)
+    }
+    if all_triggers:
+        datasets.update({
+            "hit_trigger": create_resizable_dataset(f, "hit_trigger", (), np.int32, profile),
+            "event_triggers_index": create_resizable_dataset(f, "event_triggers_index", (), np.int64, profile),
+            "trigger_time": create_resizable_dataset(f, "trigger_time", (), np.float32, profile),
+            "trigger_type": create_resizable_dataset(f, "trigger_type", (), np.int32, profile),
+            "trigger_hits_index": create_resizable_dataset(f, "trigger_hits_index", (), np.int64, profile)
+        })
+    return datasets
+
+
+def create_truehit_datasets(f, profile="fast-read"):
+    """Create the empty resizable datasets of a true hit array file, returning them in a dictionary by name"""
+    return {
+        "labels": create_resizable_dataset(f, "labels", (), np.int32, profile),
+        "root_files": create_resizable_dataset(f, "root_files", (), h5py.special_dtype(vlen=str), profile),
+        "event_ids": create_resizable_dataset(f, "event_ids", (), np.int32, profile),
+        "hit_time": create_resizable_dataset(f, "hit_time", (), np.float32, profile),
+        "hit_pmt": create_resizable_dataset(f, "hit_pmt", (), np.int32, profile),
+        "hit_parent": create_resizable_dataset(f, "hit_parent", (), np.int32, profile),
+        "event_hits_index": create_resizable_dataset(f, "event_hits_index", (), np.int64, profile),
+        "energies": create_resizable_dataset(f, "energies", (1,), np.float32, profile),
+        "positions": create_resizable_dataset(f, "positions", (1, 3), np.float32, profile),
+        "angles": create_resizable_dataset(f, "angles", (2,), np.float32, profile),
+        "veto": create_resizable_dataset(f, "veto", (), np.bool_, profile),
+        "veto2": create_resizable_dataset(f, "veto2", (), np.bool_, profile)
+    }
+
+
+def create_grid_datasets(f, grid_shape, profile="fast-read", sparse=False):
+    """
+    Create the empty resizable datasets of a grid file, with event_data of grid_shape for each event, or the datasets
+    of sparse grids if sparse is True, returning them in a dictionary by name
+    """
+    datasets = {
+        "labels": create_resizable_dataset(f, "labels", (), np.int32, profile),
+        "root_files": create_resizable_dataset(f, "root_files", (), h5py.special_dtype(vlen=str), profile),
+        "event_ids": create_resizable_dataset(f, "event_ids", (), np.int32, profile),
+        "energies": create_resizable_dataset(f, "energies", (1,), np.float32, profile),
+        "positions": create_resizable_dataset(f, "positions", (1, 3), np.float32, profile),
+        "angles": create_resizable_dataset(f, "angles", (2,), np.float32, profile)
+    }
+    if sparse:
+        datasets.update(create_sparse_grid_datasets(f, grid_shape, profile))
+    else:
+        datasets["event_data"] = create_resizable_dataset(f, "event_data", grid_shape, np.float32, profile)
+    return datasets
+
+
+def create_sparse_grid_datasets(f, grid_shape, profile="fast-read"):
+    """
+    Create the empty resizable datasets of sparse grids, which store only the non-zero cells of each event's grid:
+    grid_cell and grid_value give the index of each cell in the flattened grid and its value, and event_grid_index the
+    index of each event's first cell. The shape of the grids is kept in the grid_shape attribute of grid_cell.
+    """
+    datasets = {
+        "event_grid_index": create_resizable_dataset(f, "event_grid_index", (), np.int64, profile),
+        "grid_cell": create_resizable_dataset(f, "grid_cell", (), np.int32, profile),
+        "grid_value": create_resizable_dataset(f, "grid_value", (), np.float32, profile)
+    }
+    datasets["grid_cell"].attrs["grid_shape"] = grid_shape
+    return datasets
+
+
+def write_grids(writers, grids):
+    """
+    Write the grids of a block of events, to event_data if the writers are of dense grids, or otherwise as the non-zero
+    cells of each grid to the datasets of sparse grids
+    """
+    if "event_data" in writers:
+        writers["event_data"].write(grids)
+        return
+    flat_grids = grids.reshape(len(grids), -1)
+    events, cells = np.nonzero(flat_grids)
+    counts = np.bincount(events, minlength=len(grids))
+    writers["event_grid_index"].write(writers["grid_value"].size + np.cumsum(counts) - counts)
+    writers["grid_cell"].write(cells.astype(np.int32))
+    writers["grid_value"].write(flat_grids[events, cells])
+
+
+def write_event_info(writers, event_info, labels):
+    """
+    Write the per-event values given by event_utils.get_event_info, and the events' labels, to those of the writers'
+    datasets that the output has
+    """
+    writers["event_ids"].write(event_info["event_id"])
+    writers["root_files"].write(event_info["root_file"])
+    writers["labels"].write(labels)
+    writers["energies"].write(event_info["energy"].reshape(-1, 1))
+    writers["positions"].write(event_info["position"].reshape(-1, 1, 3))
+    writers["angles"].write(event_info["angles"])
+    if "veto" in writers:
+        writers["veto"].write(event_info["veto"])
+        writers["veto2"].write(event_info["veto2"])
+
+
+def convert_parallel(convert_part, input_files, output_file, jobs, *args):
+    """
+    Split the input files into consecutive groups converted in parallel by worker processes, each calling
+    convert_part(files, part_file, *args) to write a partial file next to output_file. Returns the partial files in
+    the order of the input files, to be joined with stitch_files.
+    """
+    groups = [list(g) for g in np.array_split(np.array(input_files, dtype=object), jobs) if len(g) > 0]
+    part_files = [os.path.splitext(output_file)[0] + "_part" + str(i) + ".h5" for i in range(len(groups))]
+    tasks = [(convert_part, group, part_file, args) for group, part_file in zip(groups, part_files)]
+    # Use fresh worker processes rather than forking this one, which already has the output file open
+    with multiprocessing.get_context("spawn").Pool(jobs) as pool:
+        for part_file in pool.imap_unordered(convert_task, tasks):
+            print("Finished converting", part_file, flush=True)
+    return part_files
+
+
+def convert_task(task):
+    """Run one task of convert_parallel in a worker process, returning its partial file"""
+    convert_part, files, part_file, args = task
+    return convert_part(files, part_file, *args)
+
+
+def stitch_files(part_files, f, profile="fast-read"):
+    """
+    Concatenate the datasets of partial output files into the open hdf5 file f, with the layout of a storage profile,
+    shifting each part's index datasets by the number of rows they index in the parts before it, then remove the
+    partial files
+    """
+    parts = [h5py.File(p, 'r') for p in part_files]
+    copy_datasets(parts, f, profile)
+    for p in parts:
+        p.close()
+    for p in part_files:
+        os.remove(p)
+
+
+def copy_datasets(parts, f, profile="fast-read"):
+    """
+    Write the concatenation of each dataset of the open hdf5 files parts into a new dataset of f, with the layout of a
+    storage profile, shifting each part's index datasets by the number of rows they index in the parts before it
+    """
+    for name in parts[0]:
+        shape = (sum(p[name].shape[0] for p in parts),) + parts[0][name].shape[1:]
+        print("writing", name, "shape", shape, flush=True)
+        dset = create_dataset(f, name, shape, parts[0][name].dtype, profile)
+        dset.attrs.update(parts[0][name].attrs)
+        row_bytes = max(1, int(np.prod(shape[1:])) * dset.dtype.itemsize)
+        block_rows = max(1, 64*chunk_bytes // row_bytes)
+        start = 0
+        index_offset = 0
+        for p in parts:
+            part = p[name]
+            # copy in blocks to keep memory use bounded for large hit datasets
+            for block_start in range(0, part.shape[0], block_rows):
+                block = part[block_start:block_start+block_rows]
+                if name in INDEX_DATASETS:
+                    block = block + index_offset
+                dset[start+block_start:start+block_start+len(block)] = block
+            start += part.shape[0]
+            if name in INDEX_DATASETS:
+                index_offset += p[INDEX_DATASETS[name]].shape[0]
+
+
+def relayout_contiguous(path):
+    """
+    Rewrite a finished file written with the fast-read profile so that its resizable datasets, which have to be chunked
+    while they are written, are contiguous like the rest of the profile and can be memory-mapped. HDF5 does not reclaim
+    the space of deleted datasets, so the datasets are copied into a new file that then replaces the file.
+    """
+    with h5py.File(path, 'r') as f:
+        if all(dset.chunks is None for dset in f.values()):
+            return
+        print("writing contiguous datasets of", path, flush=True)
+        contiguous_file = os.path.splitext(path)[0] + "_contiguous.h5"
+        with h5py.File(contiguous_file, 'w') as out:
+            out.attrs.update(f.attrs)
+            copy_datasets([f], out, "fast-read")
+    os.replace(contiguous_file, path)
+
+
+def save_checkpoint(f, **progress):
+    """
+    Record progress of a conversion in the attributes of the output file, after flushing everything written so far to
+    disk, so that a killed job can be resumed from the last checkpoint. Each keyword is stored as a checkpoint-<name>
+    attribute.
+    """
+    f.flush()
+    for name, value in progress.items():
+        f.attrs["checkpoint-" + name] = value
+    f.flush()
+
+
+def files_digest(input_files):
+    """A short digest of a list of input files, to check that a checkpoint was made converting the same files"""
+    return hashlib.sha1("\n".join(input_files).encode()).hexdigest()
+
+
+def load_checkpoint(f):
+    """Returns the progress recorded by save_checkpoint, as a dictionary that is empty if there is no checkpoint"""
+    return {k[len("checkpoint-"):]: f.attrs[k] for k in f.attrs if k.startswith("checkpoint-")}
+
+
+def clear_checkpoint(f):
+    """Remove the checkpoint attributes once the output file is complete"""
+    for k in [k for k in f.attrs if k.startswith("checkpoint-")]:
+        del f.attrs[k]
+    f.flush()
+
+
+def is_complete(f):
+    """Whether an existing output file has been completely written, i.e. it has datasets and no checkpoint left"""
+    return len(f) > 0 and not load_checkpoint(f)
+
+
+def open_output(output_file, resume=False):
+    """Open an output file for writing, keeping its contents if resuming and it exists, returning it and the mode"""
+    if resume and os.path.isfile(output_file):
+        return h5py.File(output_file, 'a'), True
+    return h5py.File(output_file, 'w'), False
@@ -0,0 +1,179 @@
+"""
+Reader for the hit array hdf5 files written by np_to_digihit_array_hdf5.py, np_to_truehit_array_hdf5.py and
+root_to_digihit_array_hdf5.py
+
+These files hold the hits of all events concatenated in hit_* datasets (hit_pmt, hit_time, hit_charge, ...), with
+event_hits_index giving the index of the first hit of each event, and one row per event in the other datasets (labels,
+energies, positions, ...). Event boundaries are read into memory once, so finding the hits of an event needs no hdf5
+call, and hit datasets stored contiguous and uncompressed (the fast-read storage profile) are memory-mapped directly
+so that reading them makes no h5py call at all. Chunked or compressed hit datasets are read through h5py, with one read
+per run of consecutive events.
+
+Files written with --all-triggers keep the hits of every trigger, grouped by trigger within each event, with hit_trigger
+giving each hit's trigger within its event, trigger_time, trigger_type and trigger_hits_index (the index of the first
+hit of each trigger) with one row per trigger, and event_triggers_index giving the index of each event's first trigger.
+select_triggers() turns a trigger selection policy into ranges of hits, read with HitArrayDataset.get_hit_ranges(), so
+that changing the policy needs no new conversion.
+"""
+
+import h5py
+import numpy as np
+
+from root_utils.event_utils import offsets_from_counts, event_index, first_trigger_indices
+
+# Datasets of files written with --all-triggers that have one row per trigger, or index the triggers of each event
+TRIGGER_NAMES = ("trigger_time", "trigger_type", "trigger_hits_index", "event_triggers_index")
+
+
+def memmap_dataset(path, dset):
+    """Memory-map a contiguous, uncompressed hdf5 dataset, or return None if it is not stored that way"""
+    if dset.chunks is not None or dset.compression is not None or dset.dtype.kind not in "biuf":
+        return None
+    offset = dset.id.get_offset()
+    if offset is None:  # no storage allocated yet, i.e. no data has been written
+        return None
+    return np.memmap(path, dtype=dset.dtype, mode="r", offset=offset, shape=dset.shape)
+
+
+def read_ranges(dset, starts, range_offsets):
+    """
+    Read the ranges [starts[i], starts[i] + range_offsets[i+1] - range_offsets[i]) of an h5py dataset into one array,
+    in the positions given by range_offsets, with one read for each run of adjacent or overlapping ranges
+    """
+    stops = starts + np.diff(range_offsets)
+    order = np.argsort(starts, kind="stable")
+    sorted_starts = starts[order]
+    run_ends = np.maximum.accumulate(stops[order])
+    values = np.empty(range_offsets[-1], dtype=dset.dtype)
+    # a new run begins at each range starting after the end of all ranges before it
+    run_starts = np.flatnonzero(sorted_starts[1:] > run_ends[:-1]) + 1
+    run_starts = np.insert(run_starts, 0, 0) if len(order) > 0 else run_starts
+    run_stops = np.append(run_starts[1:], len(order))
+    for run_start, run_stop in zip(run_starts, run_stops):
+        block_start = sorted_starts[run_start]
+        block = dset[block_start:run_ends[run_stop-1]]
+        for i in order[run_start:run_stop]:
+            values[range_offsets[i]:range_offsets[i+1]] = block[starts[i]-block_start:stops[i]-block_start]
+    return values
+
+
+class HitArrayDataset:
+    """
+    Random access to the events of a hit array file. Indexing with an event number returns a dictionary of that
+    event's hits (the hit_* datasets, without the prefix) and its values of the per-event datasets. get_batch() does the
+    same for a list of events at once, concatenating their hits.
+    """
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.file = h5py.File(path, "r")
+        self.hit_names = [n for n in self.file if n.startswith("hit_")]
+        self.event_names = [n for n in self.file
+                            if n not in self.hit_names and n != "event_hits_index" and n not in TRIGGER_NAMES]
+        self.n_hits = self.file[self.hit_names[0]].shape[0] if self.hit_names else 0
+        # boundaries of each event's hits, event i has hits [offsets[i], offsets[i+1])
+        self.offsets = np.append(self.file["event_hits_index"][()], self.n_hits).astype(np.int64)
+        self.hits = {}
+        for name in self.hit_names:
+            dset = self.file[name]
+            array = memmap_dataset(path, dset) if mmap else None
+            self.hits[name] = array if array is not None else dset
+        self.event_arrays = {}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def close(self):
+        self.hits = {}
+        self.event_arrays = {}
+        self.file.close()
+
+    def event_array(self, name):
+        """Returns a per-event dataset, read into memory on first use"""
+        if name not in self.event_arrays:
+            self.event_arrays[name] = self.file[name][()]
+        return self.event_arrays[name]
+
+    def hit_counts(self):
+        return np.diff(self.offsets)
+
+    def __getitem__(self, event):
+        start, stop = self.offsets[event], self.offsets[event+1]
+        result = {name[len("hit_"):]: np.asarray(hits[start:stop]) for name, hits in self.hits.items()}
+        for name in self.event_names:
+            result[name] = self.event_array(name)[event]
+        return result
+
+    def get_batch(self, events):
+        """
+        Returns the hits of a list of events concatenated into one array per hit dataset, in the given order of events,
+        with "hit_offsets" giving the boundaries of each event's hits in those arrays, and the per-event datasets for
+        those events
+        """
+        events = np.asarray(events, dtype=np.int64)
+        result = self.get_hit_ranges(self.offsets[events], self.offsets[events+1])
+        for name in self.event_names:
+            result[name] = self.event_array(name)[events]
+        return result
+
+    def get_hit_ranges(self, starts, stops):
+        """
+        Returns the hits in the ranges [starts[i], stops[i]) of the hit datasets concatenated into one array per hit
+        dataset, in the given order of ranges, with "hit_offsets" giving the boundaries of each range in those arrays
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        counts = np.asarray(stops, dtype=np.int64) - starts
+        hit_offsets = offsets_from_counts(counts)
+        # index of each hit to gather, in the hit datasets
+        hit_indices = np.repeat(starts - hit_offsets[:-1], counts) + np.arange(hit_offsets[-1])
+        result = {"hit_offsets": hit_offsets}
+        for name, hits in self.hits.items():
+            if isinstance(hits, np.ndarray):
+                result[name[len("hit_"):]] = hits[hit_indices]
+            else:
+                result[name[len("hit_"):]] = read_ranges(hits, starts, hit_offsets)
+        return result
+
+
+def select_triggers(dataset, policy="first", trigger_types=(0,), time_window=None, min_hits=1):
+    """
+    Build the selection of hits for a trigger policy from the trigger tables of a HitArrayDataset of a file written
+    with --all-triggers, without reading any hits. Only triggers with a type in trigger_types (or any type if None)
+    and a trigger_time within time_window = (start, stop) if it is given are considered. The policy is one of
+        "first": one entry per event, for its earliest considered trigger if it has at least min_hits hits, which
+                 with the defaults is the selection of the default conversion
+        "each":  one entry per considered trigger with at least min_hits hits, so events with several triggers give
+                 several entries
+        "all":   one entry per event that has a considered trigger with at least min_hits hits, with all of the
+                 event's hits
+    Returns a dictionary of arrays with one value per entry: "event", the event number, "trigger", the index of the
+    trigger in the trigger datasets (-1 for the "all" policy), and "hit_start" and "hit_stop", the range of its hits.
+    Events without any such trigger are left out.
+    """
+    trigger_offsets = np.append(dataset.event_array("event_triggers_index"),
+                                dataset.file["trigger_time"].shape[0]).astype(np.int64)
+    trigger_times = dataset.event_array("trigger_time")
+    trigger_hits = np.append(dataset.event_array("trigger_hits_index"), dataset.n_hits).astype(np.int64)
+    enough_hits = np.diff(trigger_hits) >= min_hits
+    selected = np.ones(len(trigger_times), dtype=bool)
+    if trigger_types is not None:
+        selected &= np.isin(dataset.event_array("trigger_type"), trigger_types)
+    if time_window is not None:
+        selected &= (trigger_times >= time_window[0]) & (trigger_times < time_window[1])
+    if policy == "first":
+        # the earliest trigger is chosen before min_hits is applied, as in the conversion, so an event whose earliest
+        # trigger has too few hits is left out rather than falling back to a later trigger
+        first = first_trigger_indices(trigger_times, trigger_offsets, selected)
+        events = np.flatnonzero(first >= 0)
+        triggers = trigger_offsets[events] + first[events]
+        events, triggers = events[enough_hits[triggers]], triggers[enough_hits[triggers]]
+    elif policy == "each":
+        triggers = np.flatnonzero(selected & enough_hits)
+        events = event_index(trigger_offsets)[triggers]
+    elif policy == "all":
+        events = np.flatnonzero(np.diff(offsets_from_counts(selected & enough_hits)[trigger_offsets]) > 0)
+        return {"event": events, "trigger": np.full(len(events), -1, dtype=np.int64),
+                "hit_start": dataset.offsets[events], "hit_stop": dataset.offsets[events+1]}
+    else:
+        raise ValueError("Unknown trigger policy " + str(policy))
+    return {"event": events, "trigger": triggers,
+            "hit_start": trigger_hits[triggers], "hit_stop": trigger_hits[triggers+1]}
@@ -1,18 +1,32 @@
 import argparse
+import sys
 import h5py
 import numpy as np
+from root_utils.h5_utils import (STORAGE_PROFILES, INDEX_DATASETS, create_dataset, save_checkpoint, load_checkpoint,
+                                 clear_checkpoint, is_complete, open_output, files_digest)
 
 def get_args():
     parser = argparse.ArgumentParser(description='merge hdf5 files with common datasets by concatenating them together')
     parser.add_argument('input_files', type=str, nargs='+')
     parser.add_argument('-o', '--output_file', type=str)
+    parser.add_argument('-p', '--profile', choices=list(STORAGE_PROFILES), default='fast-read',
+                        help='storage layout and compression of the output datasets: fast-read (contiguous, '
+                             'uncompressed), balanced (small lzf chunks) or archive (gzip)')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue an interrupted merge from the last checkpoint of an existing output file')
     args = parser.parse_args()
     return args
 
 if __name__ == '__main__':
     config = get_args()
     print("output file:", config.output_file)
-    out_file = h5py.File(config.output_file, 'w')
+    out_file, resumed = open_output(config.output_file, config.resume)
+    if resumed and is_complete(out_file):
+        print(f"{out_file.filename} is already complete.")
+        sys.exit(0)
+    checkpoint = load_checkpoint(out_file) if resumed else {}
+    if checkpoint and checkpoint["input-files"] != files_digest(config.input_files):
+        raise ValueError(f"Cannot resume {out_file.filename}, it was being merged from different input files.")
     infiles = [h5py.File(f, 'r') for f in config.input_files]
     print(f"opened input file {infiles[0].filename}")
     keys = infiles[0].keys()
@@ -25,7 +39,15 @@ if __name__ == '__main__':
             raise KeyError(f"HDF5 file {f.filename} attributes {f.attrs.keys()} do not match first file's attributes {attr_keys}.")
     for k in attr_keys:
         out_file.attrs[k]  = np.hstack([f.attrs[k] for f in infiles]).tolist()
-    for k in keys:
+    if not checkpoint:
+        save_checkpoint(out_file, **{"input-files": files_digest(config.input_files), "datasets": 0, "files": 0})
+    # number of datasets completely written, and of files written into the next dataset, at the last checkpoint
+    completed_datasets = int(checkpoint.get("datasets", 0))
+    completed_files = int(checkpoint.get("files", 0))
+    for key_index, k in enumerate(keys):
+        if key_index < completed_datasets:
+            print(f"skipping {k}, already written")
+            continue
         dtype = infiles[0][k].dtype
         shape = list(infiles[0][k].shape)
         for f in infiles[1:]:
@@ -33,21 +55,32 @@ if __name__ == '__main__':
             if shape[1:] != list(f[k].shape[1:]):
                 raise ValueError(f"Array {k} in {f.filename} has shape {f[k].shape} which is incompatible with extending previous files shape {shape}.")
         print(f"writing {k}, shape {shape}, dtype {dtype}")
-        dset = out_file.create_dataset(k, shape=shape, dtype=dtype)
+        if k in out_file:  # created before the merge was interrupted
+            dset = out_file[k]
+        else:
+            dset = create_dataset(out_file, k, tuple(shape), dtype, config.profile)
+            dset.attrs.update(infiles[0][k].attrs)
         isIndex = False
-        if k == "event_hits_index":
+        if k in INDEX_DATASETS:
             isIndex = True
             offset = 0
-            print("  is an index array, so adding length of hit_pmt array in each file to the index values of the following file")
+            print(f"  is an index array, so adding length of {INDEX_DATASETS[k]} array in each file to the index values of the following file")
         start = 0
-        for f in infiles:
+        for file_index, f in enumerate(infiles):
             stop = start+f[k].shape[0]
-            print(f"  entries {start}:{stop} from file {f.filename}")
-            if isIndex:
-                dset[start:stop] = np.array(f[k]) + offset
-                offset += f['hit_pmt'].shape[0]
+            if key_index == completed_datasets and file_index < completed_files:
+                print(f"  entries {start}:{stop} from file {f.filename} already written")
             else:
-                dset[start:stop] = f[k]
+                print(f"  entries {start}:{stop} from file {f.filename}")
+                if isIndex:
+                    dset[start:stop] = np.array(f[k]) + offset
+                else:
+                    dset[start:stop] = f[k]
+                save_checkpoint(out_file, datasets=key_index, files=file_index+1)
+            if isIndex:
+                offset += f[INDEX_DATASETS[k]].shape[0]
             start = stop
+        save_checkpoint(out_file, datasets=key_index+1, files=0)
+    clear_checkpoint(out_file)
     print(f"Written output file {out_file.filename}.")
     out_file.close()
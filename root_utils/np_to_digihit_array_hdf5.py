@@ -5,22 +5,159 @@ import subprocess
 from datetime import datetime
 import argparse
 import h5py
+from root_utils.flat_npz import EventFile
+from root_utils.event_utils import (offsets_from_counts, event_index, first_trigger_indices, select_trigger_hits,
+                                    get_event_info, get_labels)
+from root_utils.h5_utils import (STORAGE_PROFILES, create_digihit_datasets, write_event_info, buffered_writers,
+                                 flush_all, convert_parallel, stitch_files, relayout_contiguous, save_checkpoint,
+                                 load_checkpoint, clear_checkpoint, is_complete, open_output, files_digest)
 
 
 def get_args():
     parser = argparse.ArgumentParser(description='convert and merge .npz files to hdf5')
     parser.add_argument('input_files', type=str, nargs='+')
     parser.add_argument('-o', '--output_file', type=str)
+    parser.add_argument('-p', '--profile', choices=list(STORAGE_PROFILES), default='fast-read',
+                        help='storage layout and compression of the output datasets: fast-read (contiguous, '
+                             'uncompressed), balanced (small lzf chunks) or archive (gzip)')
+    parser.add_argument('--buffer-mb', type=float, default=64,
+                        help='size in MB of the in-memory buffer of each output dataset, written out in blocks')
     parser.add_argument('-H', '--half-height', type=float, default=300)
     parser.add_argument('-R', '--radius', type=float, default=400)
+    parser.add_argument('-a', '--all-triggers', action='store_true',
+                        help='keep the hits of all triggers, with hit_trigger and per-trigger datasets, instead of only '
+                             'the hits of the first trigger of type 0')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes converting subsets of the input files in parallel')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue an interrupted conversion from the last checkpoint of an existing output file')
     args = parser.parse_args()
     return args
 
 
+def write_hits(npz_file, writers, all_triggers=False, min_hits=1):
+    """
+    Write the digitized hits of all events of an npz file, keeping those of each event's earliest trigger of type 0,
+    or those of all triggers, grouped by trigger, along with the trigger tables if all_triggers is True
+    """
+    trigger_times = npz_file.values('trigger_time')
+    trigger_types = npz_file.values('trigger_type')
+    hit_times = npz_file.values('digi_hit_time')
+    hit_charges = npz_file.values('digi_hit_charge')
+    hit_pmts = npz_file.values('digi_hit_pmt')
+    hit_triggers = npz_file.values('digi_hit_trigger')
+    hit_offset = writers["hit_pmt"].size
+    if all_triggers:
+        # keep all hits, ordered by trigger within each event so each trigger's hits are one contiguous range
+        hit_offsets = npz_file.offsets('digi_hit_trigger')
+        trigger_offsets = npz_file.offsets('trigger_time')
+        hit_global_triggers = trigger_offsets[event_index(hit_offsets)] + hit_triggers
+        order = np.argsort(hit_global_triggers, kind="stable")
+        trigger_nhits = np.bincount(hit_global_triggers, minlength=len(trigger_times))
+        trigger_offset = writers["trigger_time"].size
+        writers["event_hits_index"].write(hit_offset + hit_offsets[:-1])
+        writers["event_triggers_index"].write(trigger_offset + trigger_offsets[:-1])
+        writers["trigger_time"].write(trigger_times)
+        writers["trigger_type"].write(trigger_types)
+        writers["trigger_hits_index"].write(hit_offset + offsets_from_counts(trigger_nhits)[:-1])
+        writers["hit_trigger"].write(hit_triggers[order])
+    else:
+        # keep the hits of the earliest trigger of type 0 of each event, for all events of the file at once
+        event_triggers = first_trigger_indices(trigger_times, npz_file.offsets('trigger_time'), trigger_types == 0)
+        selected_hits, event_nhits = select_trigger_hits(hit_triggers, npz_file.offsets('digi_hit_trigger'),
+                                                         event_triggers, min_hits)
+        writers["event_hits_index"].write(hit_offset + np.cumsum(event_nhits) - event_nhits)
+        order = np.flatnonzero(selected_hits)
+    writers["hit_time"].write(hit_times[order])
+    writers["hit_charge"].write(hit_charges[order])
+    writers["hit_pmt"].write(hit_pmts[order])
+
+
+def convert_files(input_files, f, config, profile="fast-read", resume=False):
+    """
+    Convert the given npz files into digitized hit array datasets in the open hdf5 file f, recording a checkpoint each
+    time the buffered hits are written out. If resuming, files already completed according to the checkpoint in f are
+    skipped. With config.all_triggers, the hits of every trigger are written, grouped by trigger, along with the
+    trigger tables, so that triggers can be selected later with hit_array_dataset.select_triggers.
+    """
+    min_hits = 1
+    checkpoint = load_checkpoint(f) if resume else {}
+    if "parts" in checkpoint:
+        raise ValueError("Cannot resume " + f.filename + ", it was being converted in " + str(checkpoint["parts"])
+                         + " parts, resume it with --jobs " + str(checkpoint["parts"]))
+    if checkpoint and int(checkpoint["files"]) > 0:
+        if checkpoint["input-files"] != files_digest(input_files):
+            raise ValueError("Cannot resume " + f.filename + ", it was being converted from different input files")
+        # checkpoints made before the setting was recorded have trigger datasets only if it was set
+        if bool(checkpoint.get("all-triggers", "trigger_time" in f)) != bool(config.all_triggers):
+            raise ValueError("Cannot resume " + f.filename + ", it was being converted "
+                             + ("with" if not config.all_triggers else "without") + " --all-triggers")
+        datasets = {name: f[name] for name in f}
+        # discard anything written for the file that was being converted when the job stopped
+        for name, dset in datasets.items():
+            if name.startswith("hit_"):
+                dset.resize(checkpoint["hits"], axis=0)
+            elif name.startswith("trigger_"):
+                dset.resize(checkpoint["triggers"], axis=0)
+            else:
+                dset.resize(checkpoint["events"], axis=0)
+        first_file = int(checkpoint["files"])
+        print("resuming", f.filename, "after", first_file, "completed files", flush=True)
+    else:
+        # the checkpoint is recorded first, so that a file without one is complete, and anything left by a conversion
+        # stopped before completing any input file is discarded
+        save_checkpoint(f, **{"input-files": files_digest(input_files), "all-triggers": bool(config.all_triggers),
+                              "files": 0, "events": 0, "hits": 0, "triggers": 0})
+        for name in list(f):
+            del f[name]
+        datasets = create_digihit_datasets(f, profile, config.all_triggers)
+        first_file = 0
+    writers = buffered_writers(datasets, config.buffer_mb)
+    checkpoint_hits = writers["hit_pmt"].position
+    for file_index, input_file in enumerate(input_files[first_file:], first_file):
+        print(input_file, flush=True)
+        if not os.path.isfile(input_file):
+            raise ValueError(input_file+" does not exist")
+        npz_file = EventFile(input_file)
+        # events are appended as each file is read, so the input files only need to be read once
+        event_info = get_event_info(npz_file, config.radius, config.half_height)
+        write_event_info(writers, event_info, get_labels(event_info["pid"]))
+        write_hits(npz_file, writers, config.all_triggers, min_hits)
+        npz_file.close()
+        # once the hit buffers have been written out, write out the rest too and record a checkpoint
+        if writers["hit_pmt"].position > checkpoint_hits:
+            flush_all(writers)
+            checkpoint_hits = writers["hit_pmt"].position
+            save_checkpoint(f, files=file_index+1, events=writers["event_ids"].position, hits=checkpoint_hits,
+                            triggers=writers["trigger_time"].position if config.all_triggers else 0)
+
+    flush_all(writers)
+    clear_checkpoint(f)
+    print("saved", writers["hit_pmt"].dset.shape[0], "hits in", writers["event_ids"].dset.shape[0], "events (keeping hits of events with at least", min_hits, "hits)")
+
+
+def convert_part(input_files, part_file, config):
+    """Convert a subset of the input files into a partial output file, for running in a worker process"""
+    # partial files are only read back once when stitched, so they are written uncompressed
+    f, resumed = open_output(part_file, config.resume)
+    if resumed and is_complete(f):
+        print(part_file, "is already complete", flush=True)
+    else:
+        convert_files(input_files, f, config, resume=resumed)
+    f.close()
+    return part_file
+
+
 if __name__ == '__main__':
     config = get_args()
     print("ouput file:", config.output_file)
-    f = h5py.File(config.output_file, 'w')
+    f, resumed = open_output(config.output_file, config.resume)
+    if resumed and is_complete(f):
+        print(config.output_file, "is already complete")
+        f.close()
+        if config.profile == "fast-read":  # in case the job stopped while making the datasets contiguous
+            relayout_contiguous(config.output_file)
+        sys.exit(0)
 
     script_path = os.path.dirname(os.path.abspath(__file__))
     git_status = subprocess.check_output(['git', '-C', script_path, 'status', '--porcelain', '--untracked-files=no']).decode()
@@ -28,144 +165,23 @@ if __name__ == '__main__':
         raise Exception("Directory of this script ({}) is not a clean git directory:\n{}Need a clean git directory for storing script version in output file.".format(script_path, git_status))
     git_describe = subprocess.check_output(['git', '-C', script_path, 'describe', '--always', '--long', '--tags']).decode().strip()
     print("git describe for path to this script ({}):".format(script_path), git_describe)
+    if resumed and f.attrs.get('git-describe', git_describe) != git_describe:
+        raise Exception("Cannot resume {} written by a different version of this script ({})".format(config.output_file, f.attrs['git-describe']))
     f.attrs['git-describe'] = git_describe
     f.attrs['command'] = str(sys.argv)
     f.attrs['timestamp'] = str(datetime.now())
 
-    total_rows = 0
-    total_hits = 0
-    min_hits = 1
-    good_rows = 0
-    good_hits = 0
-    print("counting events and hits, in files")
-    file_event_triggers = {}
-    for input_file in config.input_files:
-        print(input_file, flush=True)
-        if not os.path.isfile(input_file):
-            raise ValueError(input_file+" does not exist")
-        npz_file = np.load(input_file)
-        trigger_times = npz_file['trigger_time']
-        trigger_types = npz_file['trigger_type']
-        hit_triggers = npz_file['digi_hit_trigger']
-        total_rows += hit_triggers.shape[0]
-        event_triggers = np.full(hit_triggers.shape[0], np.nan)
-        for i, (times, types, hit_trigs) in enumerate(zip(trigger_times, trigger_types, hit_triggers)):
-            good_triggers = np.where(types == 0)[0]
-            if len(good_triggers) == 0:
-                continue
-            first_trigger = good_triggers[np.argmin(times[good_triggers])]
-            nhits = np.count_nonzero(hit_trigs == first_trigger)
-            total_hits += nhits
-            if nhits >= min_hits:
-                event_triggers[i] = first_trigger
-                good_hits += nhits
-                good_rows += 1
-        file_event_triggers[input_file] = event_triggers
-
-    print(len(config.input_files), "files with", total_rows, "events with ", total_hits, "hits")
-    print(good_rows, "events with at least", min_hits, "hits for a total of", good_hits, "hits")
-
-    dset_labels = f.create_dataset("labels",
-                                   shape=(total_rows,),
-                                   dtype=np.int32)
-    dset_PATHS = f.create_dataset("root_files",
-                                  shape=(total_rows,),
-                                  dtype=h5py.special_dtype(vlen=str))
-    dset_IDX = f.create_dataset("event_ids",
-                                shape=(total_rows,),
-                                dtype=np.int32)
-    dset_hit_time = f.create_dataset("hit_time",
-                                     shape=(good_hits, ),
-                                     dtype=np.float32)
-    dset_hit_charge = f.create_dataset("hit_charge",
-                                       shape=(good_hits, ),
-                                       dtype=np.float32)
-    dset_hit_pmt = f.create_dataset("hit_pmt",
-                                    shape=(good_hits, ),
-                                    dtype=np.int32)
-    dset_event_hit_index = f.create_dataset("event_hits_index",
-                                            shape=(total_rows,),
-                                            dtype=np.int64)  # int32 is too small to fit large indices
-    dset_energies = f.create_dataset("energies",
-                                     shape=(total_rows, 1),
-                                     dtype=np.float32)
-    dset_positions = f.create_dataset("positions",
-                                      shape=(total_rows, 1, 3),
-                                      dtype=np.float32)
-    dset_angles = f.create_dataset("angles",
-                                   shape=(total_rows, 2),
-                                   dtype=np.float32)
-    dset_veto = f.create_dataset("veto",
-                                 shape=(total_rows,),
-                                 dtype=np.bool_)
-    dset_veto2 = f.create_dataset("veto2",
-                                  shape=(total_rows,),
-                                  dtype=np.bool_)
-
-    offset = 0
-    offset_next = 0
-    hit_offset = 0
-    hit_offset_next = 0
-    label_map = {22: 0, 11: 1, 13: 2, 111: 3}
-    for input_file in config.input_files:
-        print(input_file, flush=True)
-        npz_file = np.load(input_file, allow_pickle=True)
-        good_events = ~np.isnan(file_event_triggers[input_file])
-        event_triggers = file_event_triggers[input_file]
-        event_ids = npz_file['event_id']
-        root_files = npz_file['root_file']
-        pids = npz_file['pid']
-        positions = npz_file['position']
-        directions = npz_file['direction']
-        energies = npz_file['energy']
-        hit_times = npz_file['digi_hit_time']
-        hit_charges = npz_file['digi_hit_charge']
-        hit_pmts = npz_file['digi_hit_pmt']
-        hit_triggers = npz_file['digi_hit_trigger']
-        track_pid = npz_file['track_pid']
-        track_energy = npz_file['track_energy']
-        track_stop_position = npz_file['track_stop_position']
-        track_start_position = npz_file['track_start_position']
-
-        offset_next += event_ids.shape[0]
-
-        dset_IDX[offset:offset_next] = event_ids
-        dset_PATHS[offset:offset_next] = root_files
-        dset_energies[offset:offset_next, :] = energies.reshape(-1, 1)
-        dset_positions[offset:offset_next, :, :] = positions.reshape(-1, 1, 3)
-
-        labels = np.full(pids.shape[0], -1)
-        for k, v in label_map.items():
-            labels[pids == k] = v
-        dset_labels[offset:offset_next] = labels
-
-        polars = np.arccos(directions[:, 1])
-        azimuths = np.arctan2(directions[:, 2], directions[:, 0])
-        dset_angles[offset:offset_next, :] = np.hstack((polars.reshape(-1, 1), azimuths.reshape(-1, 1)))
-
-        for i, (pids, energies, starts, stops) in enumerate(zip(track_pid, track_energy, track_start_position, track_stop_position)):
-            muons_above_threshold = (np.abs(pids) == 13) & (energies > 166)
-            electrons_above_threshold = (np.abs(pids) == 11) & (energies > 2)
-            gammas_above_threshold = (np.abs(pids) == 22) & (energies > 2)
-            above_threshold = muons_above_threshold | electrons_above_threshold | gammas_above_threshold
-            outside_tank = (np.linalg.norm(stops[:, (0, 2)], axis=1) > config.radius) | (np.abs(stops[:, 1]) > config.half_height)
-            dset_veto[offset+i] = np.any(above_threshold & outside_tank)
-            end_energy_estimate = energies - np.linalg.norm(stops - starts, axis=1)*2
-            muons_above_threshold = (np.abs(pids) == 13) & (end_energy_estimate > 166)
-            electrons_above_threshold = (np.abs(pids) == 11) & (end_energy_estimate > 2)
-            gammas_above_threshold = (np.abs(pids) == 22) & (end_energy_estimate > 2)
-            above_threshold = muons_above_threshold | electrons_above_threshold | gammas_above_threshold
-            dset_veto2[offset+i] = np.any(above_threshold & outside_tank)
-
-        for i, (trigs, times, charges, pmts) in enumerate(zip(hit_triggers, hit_times, hit_charges, hit_pmts)):
-            dset_event_hit_index[offset+i] = hit_offset
-            hit_indices = np.where(trigs == event_triggers[i])[0]
-            hit_offset_next += len(hit_indices)
-            dset_hit_time[hit_offset:hit_offset_next] = times[hit_indices]
-            dset_hit_charge[hit_offset:hit_offset_next] = charges[hit_indices]
-            dset_hit_pmt[hit_offset:hit_offset_next] = pmts[hit_indices]
-            hit_offset = hit_offset_next
-
-        offset = offset_next
+    if config.jobs > 1:
+        print("Converting", len(config.input_files), "files with", config.jobs, "worker processes")
+        # the partial files hold the checkpoints, the output file is only marked incomplete until they are stitched
+        save_checkpoint(f, parts=config.jobs)
+        part_files = convert_parallel(convert_part, config.input_files, config.output_file, config.jobs, config)
+        for name in list(f):  # remove anything left by a stitch that was interrupted
+            del f[name]
+        stitch_files(part_files, f, config.profile)
+        clear_checkpoint(f)
+    else:
+        convert_files(config.input_files, f, config, config.profile, resumed)
     f.close()
-    print("saved", hit_offset, "hits in", offset, "good events (each with at least", min_hits, "hits)")
+    if config.profile == "fast-read":
+        relayout_contiguous(config.output_file)
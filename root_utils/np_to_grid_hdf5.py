@@ -2,15 +2,45 @@ import numpy as np
 import os
 import argparse
 import h5py
-import root_utils.pos_utils as pu
+from root_utils.flat_npz import EventFile
+from root_utils.geometry import GEOMETRIES
+from root_utils.event_utils import first_trigger_hit_selection, grid_blocks, block_size_for
+from root_utils.h5_utils import (STORAGE_PROFILES, create_dataset, create_sparse_grid_datasets, BufferedWriter,
+                                 buffered_writers, flush_all, write_grids, relayout_contiguous)
+
+label_map = {22: 0, 11: 1, 13: 2}
+geometry = GEOMETRIES["iwcd"]
+grid_shape = geometry.grid_shape
+
 
 def get_args():
     parser = argparse.ArgumentParser(description='convert and merge .npz files to hdf5')
     parser.add_argument('input_files', type=str, nargs='+')
     parser.add_argument('-o', '--output_file', type=str)
+    parser.add_argument('-p', '--profile', choices=list(STORAGE_PROFILES), default='fast-read',
+                        help='storage layout and compression of the output datasets: fast-read (contiguous, '
+                             'uncompressed), balanced (small lzf chunks) or archive (gzip)')
+    parser.add_argument('-s', '--sparse', action='store_true',
+                        help='store only the non-zero cells of each grid, instead of the dense event_data')
+    parser.add_argument('--buffer-mb', type=float, default=64,
+                        help='size in MB of the in-memory buffer of each output dataset, written out in blocks')
     args = parser.parse_args()
     return args
 
+def event_grids(npz_file, block_size=1000):
+    """
+    Yields the barrel grids of blocks of up to block_size consecutive events of an npz file, with the charge and time
+    of the hits of each event's first trigger in each PMT of each module
+    """
+    hits, hit_event = first_trigger_hit_selection(npz_file)
+    barrel, wall_row, wall_col, channel = geometry.barrel_hits(npz_file.values('digi_hit_pmt')[hits])
+    hits, hit_event = hits[barrel], hit_event[barrel]
+    fields = [((wall_row, wall_col, channel), npz_file.values('digi_hit_charge')[hits]),
+              ((wall_row, wall_col, channel + geometry.pmts_per_module), npz_file.values('digi_hit_time')[hits])]
+    n_events = len(npz_file.offsets('digi_hit_trigger')) - 1
+    yield from grid_blocks(n_events, hit_event, fields, grid_shape, block_size)
+
+
 if __name__ == '__main__':
     config = get_args()
     print("ouput file:", config.output_file)
@@ -20,46 +50,45 @@ if __name__ == '__main__':
     for input_file in config.input_files:
         if not os.path.isfile(input_file):
             raise ValueError(input_file+" does not exist")
-        npz_file = np.load(input_file)
+        npz_file = EventFile(input_file)
         total_rows += npz_file['event_id'].shape[0]
 
-    dset_labels=f.create_dataset("labels",
-                                 shape=(total_rows,),
-                                 dtype=np.int32)
-    dset_PATHS=f.create_dataset("root_files",
-                                shape=(total_rows,),
-                                dtype=h5py.special_dtype(vlen=str))
-    dset_IDX=f.create_dataset("event_ids",
+    dset_labels=create_dataset(f, "labels",
+                               shape=(total_rows,),
+                               dtype=np.int32, profile=config.profile)
+    dset_PATHS=create_dataset(f, "root_files",
                               shape=(total_rows,),
-                              dtype=np.int32)
-    dset_event_data=f.create_dataset("event_data",
-                                     shape=(total_rows, 16, 40, 38),
-                                     dtype=np.float32)
-    dset_energies=f.create_dataset("energies",
-                                   shape=(total_rows, 1),
-                                   dtype=np.float32)
-    dset_positions=f.create_dataset("positions",
-                                    shape=(total_rows, 1, 3),
-                                    dtype=np.float32)
-    dset_angles=f.create_dataset("angles",
-                                 shape=(total_rows, 2),
-                                 dtype=np.float32)
+                              dtype=h5py.special_dtype(vlen=str), profile=config.profile)
+    dset_IDX=create_dataset(f, "event_ids",
+                            shape=(total_rows,),
+                            dtype=np.int32, profile=config.profile)
+    dset_energies=create_dataset(f, "energies",
+                                 shape=(total_rows, 1),
+                                 dtype=np.float32, profile=config.profile)
+    dset_positions=create_dataset(f, "positions",
+                                  shape=(total_rows, 1, 3),
+                                  dtype=np.float32, profile=config.profile)
+    dset_angles=create_dataset(f, "angles",
+                               shape=(total_rows, 2),
+                               dtype=np.float32, profile=config.profile)
+    if config.sparse:
+        grid_writers = buffered_writers(create_sparse_grid_datasets(f, grid_shape, config.profile),
+                                        config.buffer_mb)
+    else:
+        dset_event_data=create_dataset(f, "event_data",
+                                       shape=(total_rows,) + grid_shape,
+                                       dtype=np.float32, profile=config.profile)
+        grid_writers = {"event_data": BufferedWriter(dset_event_data, buffer_mb=config.buffer_mb)}
     offset = 0
     offset_next = 0
-    label_map = {22: 0, 11: 1, 13: 2}
     for input_file in config.input_files:
-        npz_file = np.load(input_file, allow_pickle=True)
+        npz_file = EventFile(input_file)
         event_id = npz_file['event_id']
         root_file = npz_file['root_file']
         pid = npz_file['pid']
         position = npz_file['position']
         direction = npz_file['direction']
         energy = npz_file['energy']
-        hit_time = npz_file['digi_hit_time']
-        hit_charge = npz_file['digi_hit_charge']
-        hit_pmt = npz_file['digi_hit_pmt']
-        hit_trigger = npz_file['digi_hit_trigger']
-        trigger_time = npz_file['trigger_time']
 
         offset_next += event_id.shape[0]
 
@@ -78,16 +107,11 @@ if __name__ == '__main__':
         azimuth = np.arctan2(direction[:,2], direction[:,0])
         dset_angles[offset:offset_next,:] = np.hstack((polar.reshape(-1,1),azimuth.reshape(-1,1)))
 
-        for i in range(hit_pmt.shape[0]):
-            first_trigger = np.argmin(trigger_time[i])
-            module_index = pu.module_index(hit_pmt[i])
-            wall_indices = np.where((hit_trigger[i]==first_trigger) & pu.is_barrel(module_index))
-            pmt_in_module = pu.pmt_in_module_id(hit_pmt[i][wall_indices])
-            wall_row, wall_col = pu.row_col(module_index[wall_indices])
-            event_data = np.zeros((16, 40, 38))
-            event_data[wall_row, wall_col, pmt_in_module] = hit_charge[i][wall_indices]
-            event_data[wall_row, wall_col, pmt_in_module + 19] = hit_time[i][wall_indices]
-            dset_event_data[offset+i,:] = event_data
+        for event_data in event_grids(npz_file, block_size_for(grid_shape, config.buffer_mb)):
+            write_grids(grid_writers, event_data)
 
         offset = offset_next
+    flush_all(grid_writers)
     f.close()
+    if config.sparse and config.profile == "fast-read":
+        relayout_contiguous(config.output_file)
@@ -0,0 +1,107 @@
+"""
+Python 3 script for converting .npz files written by event_dump.py into any combination of the digitized hit array,
+true hit array and barrel grid hdf5 files in a single pass
+
+Each input file is read once and its per-event values (labels, angles, veto flags, ...) are calculated once, then
+written to each requested output. The outputs have the same datasets as those of np_to_digihit_array_hdf5.py,
+np_to_truehit_array_hdf5.py and np_to_grid_hdf5.py.
+"""
+
+import os
+import sys
+import subprocess
+from datetime import datetime
+import argparse
+import h5py
+from root_utils.flat_npz import EventFile
+from root_utils.event_utils import get_event_info, get_labels, block_size_for
+from root_utils.h5_utils import (STORAGE_PROFILES, create_digihit_datasets, create_truehit_datasets,
+                                 create_grid_datasets, write_event_info, write_grids, buffered_writers, flush_all,
+                                 relayout_contiguous)
+import root_utils.np_to_digihit_array_hdf5 as digihit
+import root_utils.np_to_truehit_array_hdf5 as truehit
+import root_utils.np_to_grid_hdf5 as grid
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='convert .npz files to digitized hit, true hit and grid hdf5 files, '
+                                                 'reading each input file once')
+    parser.add_argument('input_files', type=str, nargs='+')
+    parser.add_argument('-d', '--digihit-file', type=str, help='output file of digitized hit arrays')
+    parser.add_argument('-t', '--truehit-file', type=str, help='output file of true hit arrays')
+    parser.add_argument('-g', '--grid-file', type=str, help='output file of barrel grids')
+    parser.add_argument('-s', '--sparse-grid', action='store_true',
+                        help='store only the non-zero cells of each grid in the grid output')
+    parser.add_argument('-p', '--profile', choices=list(STORAGE_PROFILES), default='fast-read',
+                        help='storage layout and compression of the output datasets: fast-read (contiguous, '
+                             'uncompressed), balanced (small lzf chunks) or archive (gzip)')
+    parser.add_argument('--buffer-mb', type=float, default=64,
+                        help='size in MB of the in-memory buffer of each output dataset, written out in blocks')
+    parser.add_argument('-H', '--half-height', type=float, default=300)
+    parser.add_argument('-R', '--radius', type=float, default=400)
+    parser.add_argument('-a', '--all-triggers', action='store_true',
+                        help='keep the hits of all triggers in the digitized hit output, with hit_trigger and '
+                             'per-trigger datasets, instead of only the hits of the first trigger of type 0')
+    args = parser.parse_args()
+    if not (args.digihit_file or args.truehit_file or args.grid_file):
+        parser.error('at least one of --digihit-file, --truehit-file and --grid-file is required')
+    return args
+
+
+if __name__ == '__main__':
+    config = get_args()
+
+    script_path = os.path.dirname(os.path.abspath(__file__))
+    git_status = subprocess.check_output(['git', '-C', script_path, 'status', '--porcelain', '--untracked-files=no']).decode()
+    if git_status:
+        raise Exception("Directory of this script ({}) is not a clean git directory:\n{}Need a clean git directory for storing script version in output file.".format(script_path, git_status))
+    git_describe = subprocess.check_output(['git', '-C', script_path, 'describe', '--always', '--long', '--tags']).decode().strip()
+    print("git describe for path to this script ({}):".format(script_path), git_describe)
+
+    # each output's file, the writers of its datasets and the label of each pid
+    outputs = {}
+    for name, output_file in (("digihit", config.digihit_file), ("truehit", config.truehit_file),
+                              ("grid", config.grid_file)):
+        if not output_file:
+            continue
+        print(name, "output file:", output_file)
+        f = h5py.File(output_file, 'w')
+        f.attrs['git-describe'] = git_describe
+        f.attrs['command'] = str(sys.argv)
+        f.attrs['timestamp'] = str(datetime.now())
+        if name == "digihit":
+            datasets = create_digihit_datasets(f, config.profile, config.all_triggers)
+            label_map = None
+        elif name == "truehit":
+            datasets = create_truehit_datasets(f, config.profile)
+            label_map = truehit.label_map
+        else:
+            datasets = create_grid_datasets(f, grid.grid_shape, config.profile, config.sparse_grid)
+            label_map = grid.label_map
+        outputs[name] = (f, buffered_writers(datasets, config.buffer_mb), label_map)
+
+    for input_file in config.input_files:
+        print(input_file, flush=True)
+        if not os.path.isfile(input_file):
+            raise ValueError(input_file+" does not exist")
+        npz_file = EventFile(input_file)
+        event_info = get_event_info(npz_file, config.radius, config.half_height)
+        for name, (f, writers, label_map) in outputs.items():
+            write_event_info(writers, event_info, get_labels(event_info["pid"], label_map))
+            if name == "digihit":
+                digihit.write_hits(npz_file, writers, config.all_triggers)
+            elif name == "truehit":
+                truehit.write_hits(npz_file, writers)
+            else:
+                block_size = block_size_for(grid.grid_shape, config.buffer_mb)
+                for event_data in grid.event_grids(npz_file, block_size):
+                    write_grids(writers, event_data)
+        npz_file.close()
+
+    for name, (f, writers, label_map) in outputs.items():
+        flush_all(writers)
+        print("saved", f["event_ids"].shape[0], "events in", f.filename)
+        output_file = f.filename
+        f.close()
+        if config.profile == "fast-read":
+            relayout_contiguous(output_file)
@@ -6,105 +6,110 @@ from datetime import datetime
 import argparse
 import h5py
 import root_utils.pos_utils as pu
+from root_utils.flat_npz import EventFile
+from root_utils.event_utils import get_veto
+from root_utils.h5_utils import (STORAGE_PROFILES, create_dataset, BufferedWriter, flush_all, convert_parallel,
+                                 stitch_files)
+
+label_map = {22: 0, 11: 1, 13: 2}
+
 
 def get_args():
     parser = argparse.ArgumentParser(description='convert and merge .npz files to hdf5')
     parser.add_argument('input_files', type=str, nargs='+')
     parser.add_argument('-o', '--output_file', type=str)
+    parser.add_argument('-p', '--profile', choices=list(STORAGE_PROFILES), default='fast-read',
+                        help='storage layout and compression of the output datasets: fast-read (contiguous, '
+                             'uncompressed), balanced (small lzf chunks) or archive (gzip)')
+    parser.add_argument('--buffer-mb', type=float, default=64,
+                        help='size in MB of the in-memory buffer of each output dataset, written out in blocks')
     parser.add_argument('-H', '--half-height', type=float, default=300)
     parser.add_argument('-R', '--radius', type=float, default=400)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes converting subsets of the input files in parallel')
     args = parser.parse_args()
     return args
 
-if __name__ == '__main__':
-    config = get_args()
-    print("ouput file:", config.output_file)
-    f = h5py.File(config.output_file, 'w')
-    
-    script_path = os.path.dirname(os.path.abspath(__file__))
-    git_status = subprocess.check_output(['git', '-C', script_path, 'status', '--porcelain', '--untracked-files=no']).decode()
-    if git_status:
-        raise Exception("Directory of this script ({}) is not a clean git directory:\n{}Need a clean git directory for storing script version in output file.".format(script_path, git_status))
-    git_describe = subprocess.check_output(['git', '-C', script_path, 'describe', '--always', '--long', '--tags']).decode().strip()
-    print("git describe for path to this script ({}):".format(script_path), git_describe)
-    f.attrs['git-describe'] = git_describe
-    f.attrs['command'] = str(sys.argv)
-    f.attrs['timestamp'] = str(datetime.now())
+def write_hits(npz_file, writers):
+    """Write the true hits of all events of an npz file"""
+    hit_offsets = npz_file.offsets('true_hit_pmt')
+    writers["event_hits_index"].write(writers["hit_pmt"].size + hit_offsets[:-1])
+    writers["hit_time"].write(npz_file.values('true_hit_time'))
+    writers["hit_pmt"].write(npz_file.values('true_hit_pmt'))
+    writers["hit_parent"].write(npz_file.values('true_hit_parent'))
 
+
+def convert_files(input_files, f, config, profile="fast-read"):
+    """Convert the given npz files into true hit array datasets in the open hdf5 file f"""
     total_rows = 0
     total_hits = 0
     print("counting events and hits in files")
-    for input_file in config.input_files:
+    for input_file in input_files:
         print(input_file, flush=True)
         if not os.path.isfile(input_file):
             raise ValueError(input_file+" does not exist")
-        npz_file = np.load(input_file)
-        hit_pmts = npz_file['true_hit_pmt']
-        total_rows += hit_pmts.shape[0]
-        for h in hit_pmts:
-            total_hits += h.shape[0]
-    
-    print(len(config.input_files), "files with", total_rows, "events with ", total_hits, "hits")
+        npz_file = EventFile(input_file)
+        hit_offsets = npz_file.offsets('true_hit_pmt')
+        total_rows += len(hit_offsets) - 1
+        total_hits += hit_offsets[-1]
 
-    dset_labels=f.create_dataset("labels",
-                                 shape=(total_rows,),
-                                 dtype=np.int32)
-    dset_PATHS=f.create_dataset("root_files",
-                                shape=(total_rows,),
-                                dtype=h5py.special_dtype(vlen=str))
-    dset_IDX=f.create_dataset("event_ids",
+    print(len(input_files), "files with", total_rows, "events with ", total_hits, "hits")
+
+    dset_labels=create_dataset(f, "labels",
+                               shape=(total_rows,),
+                               dtype=np.int32, profile=profile)
+    dset_PATHS=create_dataset(f, "root_files",
                               shape=(total_rows,),
-                              dtype=np.int32)
-    dset_hit_time=f.create_dataset("hit_time",
+                              dtype=h5py.special_dtype(vlen=str), profile=profile)
+    dset_IDX=create_dataset(f, "event_ids",
+                            shape=(total_rows,),
+                            dtype=np.int32, profile=profile)
+    dset_hit_time=create_dataset(f, "hit_time",
                                  shape=(total_hits, ),
-                                 dtype=np.float32)
-    dset_hit_pmt=f.create_dataset("hit_pmt",
-                                  shape=(total_hits, ),
-                                  dtype=np.int32)
-    dset_hit_parent=f.create_dataset("hit_parent",
-                                  shape=(total_hits, ),
-                                  dtype=np.int32)
-    dset_event_hit_index=f.create_dataset("event_hits_index",
-                                          shape=(total_rows,),
-                                          dtype=np.int64) # int32 is too small to fit large indices
-    dset_energies=f.create_dataset("energies",
-                                   shape=(total_rows, 1),
-                                   dtype=np.float32)
-    dset_positions=f.create_dataset("positions",
-                                    shape=(total_rows, 1, 3),
-                                    dtype=np.float32)
-    dset_angles=f.create_dataset("angles",
-                                 shape=(total_rows, 2),
-                                 dtype=np.float32)
-    dset_veto = f.create_dataset("veto",
-                                 shape=(total_rows,),
-                                 dtype=np.bool_)
-    dset_veto2 = f.create_dataset("veto2",
-                                  shape=(total_rows,),
-                                  dtype=np.bool_)
+                                 dtype=np.float32, profile=profile)
+    dset_hit_pmt=create_dataset(f, "hit_pmt",
+                                shape=(total_hits, ),
+                                dtype=np.int32, profile=profile)
+    dset_hit_parent=create_dataset(f, "hit_parent",
+                                   shape=(total_hits, ),
+                                   dtype=np.int32, profile=profile)
+    dset_event_hit_index=create_dataset(f, "event_hits_index",
+                                        shape=(total_rows,),
+                                        dtype=np.int64, profile=profile) # int32 is too small to fit large indices
+    dset_energies=create_dataset(f, "energies",
+                                 shape=(total_rows, 1),
+                                 dtype=np.float32, profile=profile)
+    dset_positions=create_dataset(f, "positions",
+                                  shape=(total_rows, 1, 3),
+                                  dtype=np.float32, profile=profile)
+    dset_angles=create_dataset(f, "angles",
+                               shape=(total_rows, 2),
+                               dtype=np.float32, profile=profile)
+    dset_veto = create_dataset(f, "veto",
+                               shape=(total_rows,),
+                               dtype=np.bool_, profile=profile)
+    dset_veto2 = create_dataset(f, "veto2",
+                                shape=(total_rows,),
+                                dtype=np.bool_, profile=profile)
 
     offset = 0
     offset_next = 0
-    hit_offset = 0
-    hit_offset_next = 0
-    label_map = {22: 0, 11: 1, 13: 2}
-    for input_file in config.input_files:
+    hit_datasets = {"event_hits_index": dset_event_hit_index, "hit_time": dset_hit_time, "hit_pmt": dset_hit_pmt,
+                    "hit_parent": dset_hit_parent}
+    writers = {name: BufferedWriter(dset, buffer_mb=config.buffer_mb) for name, dset in hit_datasets.items()}
+    for input_file in input_files:
         print(input_file, flush=True)
-        npz_file = np.load(input_file, allow_pickle=True)
+        npz_file = EventFile(input_file)
         event_ids = npz_file['event_id']
         root_files = npz_file['root_file']
         pids = npz_file['pid']
         positions = npz_file['position']
         directions = npz_file['direction']
         energies = npz_file['energy']
-        hit_times = npz_file['true_hit_time']
-        hit_pmts = npz_file['true_hit_pmt']
-        hit_parents = npz_file['true_hit_parent']
-        hit_triggers = npz_file['digi_hit_trigger']
-        track_pid = npz_file['track_pid']
-        track_energy = npz_file['track_energy']
-        track_stop_position = npz_file['track_stop_position']
-        track_start_position = npz_file['track_start_position']
+        track_pid = npz_file.values('track_pid')
+        track_energy = npz_file.values('track_energy')
+        track_stop_position = npz_file.values('track_stop_position')
+        track_start_position = npz_file.values('track_start_position')
 
 
         offset_next += event_ids.shape[0]
@@ -123,28 +128,44 @@ if __name__ == '__main__':
         azimuths = np.arctan2(directions[:,2], directions[:,0])
         dset_angles[offset:offset_next,:] = np.hstack((polars.reshape(-1,1),azimuths.reshape(-1,1)))
 
-        for i, (pids, energies, starts, stops) in enumerate(zip(track_pid, track_energy,track_start_position, track_stop_position)):
-            muons_above_threshold = (np.abs(pids) == 13) & (energies > 166)
-            electrons_above_threshold = (np.abs(pids) == 11) & (energies > 2)
-            gammas_above_threshold = (np.abs(pids) == 22) & (energies > 2)
-            above_threshold = muons_above_threshold | electrons_above_threshold | gammas_above_threshold
-            outside_tank = (np.linalg.norm(stops[:,(0,2)], axis=1) > config.radius) | (np.abs(stops[:, 1]) > config.half_height)
-            dset_veto[offset+i] = np.any(above_threshold & outside_tank)
-            end_energy_estimate = energies - np.linalg.norm(stops - starts)*2
-            muons_above_threshold = (np.abs(pids) == 13) & (end_energy_estimate > 166)
-            electrons_above_threshold = (np.abs(pids) == 11) & (end_energy_estimate > 2)
-            gammas_above_threshold = (np.abs(pids) == 22) & (end_energy_estimate > 2)
-            above_threshold = muons_above_threshold | electrons_above_threshold | gammas_above_threshold
-            dset_veto2[offset+i] = np.any(above_threshold & outside_tank)
-
-        for i, (times, pmts, parents) in enumerate(zip(hit_times, hit_pmts, hit_parents)):
-            dset_event_hit_index[offset+i] = hit_offset
-            hit_offset_next += times.shape[0]
-            dset_hit_time[hit_offset:hit_offset_next] = times
-            dset_hit_pmt[hit_offset:hit_offset_next] = pmts
-            dset_hit_parent[hit_offset:hit_offset_next] = parents
-            hit_offset = hit_offset_next
+        dset_veto[offset:offset_next], dset_veto2[offset:offset_next] = get_veto(
+            track_pid, track_energy, track_start_position, track_stop_position, npz_file.offsets('track_pid'),
+            config.radius, config.half_height)
+
+        write_hits(npz_file, writers)
 
         offset = offset_next
+    flush_all(writers)
+    print("saved", writers["hit_pmt"].position, "hits in", offset, "events")
+
+
+def convert_part(input_files, part_file, config):
+    """Convert a subset of the input files into a partial output file, for running in a worker process"""
+    # partial files are only read back once when stitched, so they are written uncompressed
+    with h5py.File(part_file, 'w') as f:
+        convert_files(input_files, f, config)
+    return part_file
+
+
+if __name__ == '__main__':
+    config = get_args()
+    print("ouput file:", config.output_file)
+    f = h5py.File(config.output_file, 'w')
+    
+    script_path = os.path.dirname(os.path.abspath(__file__))
+    git_status = subprocess.check_output(['git', '-C', script_path, 'status', '--porcelain', '--untracked-files=no']).decode()
+    if git_status:
+        raise Exception("Directory of this script ({}) is not a clean git directory:\n{}Need a clean git directory for storing script version in output file.".format(script_path, git_status))
+    git_describe = subprocess.check_output(['git', '-C', script_path, 'describe', '--always', '--long', '--tags']).decode().strip()
+    print("git describe for path to this script ({}):".format(script_path), git_describe)
+    f.attrs['git-describe'] = git_describe
+    f.attrs['command'] = str(sys.argv)
+    f.attrs['timestamp'] = str(datetime.now())
+
+    if config.jobs > 1:
+        print("Converting", len(config.input_files), "files with", config.jobs, "worker processes")
+        part_files = convert_parallel(convert_part, config.input_files, config.output_file, config.jobs, config)
+        stitch_files(part_files, f, config.profile)
+    else:
+        convert_files(config.input_files, f, config, config.profile)
     f.close()
-    print("saved", hit_offset, "hits in", offset, "events")
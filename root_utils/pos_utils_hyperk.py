@@ -1,72 +1,46 @@
-import numpy as np
-
-row_remap = np.flip(np.arange(75))
-
 """
-The index starts at 1 and counts up continuously with no gaps
+Mapping of HyperK PMTs to their row and column in the barrel grid, as functions of PMT numbers for the scripts and
+notebooks that use them. The detector is described, and the mapping tabulated, in geometry.py.
 """
 
+import numpy as np
+from root_utils.geometry import GEOMETRIES, BARREL, BOTTOM, TOP
+
+geometry = GEOMETRIES["hyperk"]
+row_remap = np.flip(np.arange(geometry.barrel_shape[0]))
+
 
 def is_barrel(pmt_index):
     """Returns True if pmt is in the Barrel"""
-    return (pmt_index < 22464) | ((pmt_index >= 29988) & (pmt_index < 30924))
+    return geometry.module_region(pmt_index) == BARREL
 
 
 def is_bottom(pmt_index):
     """Returns True if pmt is in the bottom cap"""
-    return (pmt_index >= 30924) & (pmt_index < 38448)
+    return geometry.module_region(pmt_index) == BOTTOM
 
 
 def is_top(pmt_index):
     """Returns True if pmt is in the top cap"""
-    return (pmt_index >= 22464) & (pmt_index < 29988)
+    return geometry.module_region(pmt_index) == TOP
 
 
 def rearrange_barrel_indices(pmt_index):
-    """rearrange indices to have consecutive module 
-    indexing starting with top row in the barrel"""
-
-    # check if there are non-barrel indices here
-    is_not_barrel = ~is_barrel(pmt_index)
-    any_not_barrel = np.bitwise_or.reduce(is_not_barrel)
-    if any_not_barrel:
-        raise ValueError('Passed a non-barrel PMT for geometry processing')
-
-    # HyperK is indexed 3 rows at a time, starts with 3 rows of the first column, then moves to next column,
-    # until those 3 rows are complete. Then it moves on to the next three rows. Rearrange to do 1 row at a time.
-    # And the bottom three rows are done in reverse order (bottom and third from bottom are swapped).
-
-    barrel_bulk_indices = np.where(pmt_index < 21528)
-    barrel_top_3rows_indices = np.where(((pmt_index >= 29988) & (pmt_index < 30924)))
-    barrel_bottom_3rows_indices = np.where(((pmt_index >= 21528) & (pmt_index < 22464)))
-
-    three_row_index = np.zeros_like(pmt_index)
-    three_row_index[barrel_bulk_indices] = (pmt_index[barrel_bulk_indices]//936) + 1
-    three_row_index[barrel_top_3rows_indices] = 0
-    three_row_index[barrel_bottom_3rows_indices] = 24
-
-    row_in_3rows = np.zeros_like(pmt_index)
-    row_in_3rows[barrel_bulk_indices] = pmt_index[barrel_bulk_indices] % 3
-    row_in_3rows[barrel_top_3rows_indices] = (pmt_index[barrel_top_3rows_indices] - 29988) % 3
-    row_in_3rows[barrel_bottom_3rows_indices] = (2-pmt_index[barrel_bottom_3rows_indices]) % 3
-
-    column_index = np.zeros_like(pmt_index)
-    column_index[barrel_bulk_indices] = (pmt_index[barrel_bulk_indices]//3) % 312
-    column_index[barrel_top_3rows_indices] = ((pmt_index[barrel_top_3rows_indices] - 29988) // 3) % 312
-    column_index[barrel_bottom_3rows_indices] = (pmt_index[barrel_bottom_3rows_indices]//3) % 312
-
-    rearranged_module_index = 312*(3*three_row_index + row_in_3rows) + column_index
-
-    return rearranged_module_index
+    """rearrange indices to have consecutive module indexing starting with top row in the barrel"""
+    row, col = row_col(pmt_index)
+    return row_remap[row]*geometry.barrel_shape[1] + col
 
 
 def row_col_rearranged(rearranged_barrel_index):
     """return row and column index based on the rearranged module indices"""
-    row = row_remap[rearranged_barrel_index//312]
-    col = rearranged_barrel_index % 312
+    row = row_remap[rearranged_barrel_index//geometry.barrel_shape[1]]
+    col = rearranged_barrel_index % geometry.barrel_shape[1]
     return row, col
 
 
 def row_col(pmt_index):
     """return row and column from a raw module index"""
-    return row_col_rearranged(rearrange_barrel_indices(pmt_index))
+    if np.any(~is_barrel(pmt_index)):
+        raise ValueError('Passed a non-barrel PMT for geometry processing')
+    module_table = geometry.module_table[pmt_index]
+    return module_table[..., 1], module_table[..., 2]
@@ -1,9 +1,88 @@
 import ROOT
 import os
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from root_utils.event_utils import offsets_from_counts, first_trigger_indices, segment_common_value
 
 ROOT.gSystem.Load(os.environ['WCSIMDIR'] + "/libWCSimRoot.so")
 
+# Fields that can be read for each event, each corresponding to one of the WCSim.get_<field>() methods
+FIELDS = ("event_info", "digitized_hits", "true_hits", "hit_photons", "tracks", "triggers")
+
+columns_header = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wcsim_columns.h")
+
+
+def declare_columns_reader():
+    """Compile the bulk reading code of wcsim_columns.h with the ROOT interpreter, returning whether it succeeded"""
+    ROOT.gInterpreter.AddIncludePath(os.environ['WCSIMDIR'] + "/include")
+    return bool(ROOT.gInterpreter.Declare('#include "{}"'.format(columns_header)))
+
+
+def load_pmt_geometry(geo):
+    """Read the tube number, position and orientation of every PMT from a WCSimRootGeom into numpy arrays"""
+    num_pmts = geo.GetWCNumPMT()
+    tube_no = np.empty(num_pmts, dtype=int)
+    position = np.empty((num_pmts, 3), dtype=np.float64)
+    orientation = np.empty((num_pmts, 3), dtype=np.float64)
+    for i in range(num_pmts):
+        pmt = geo.GetPMT(i)
+        tube_no[i] = pmt.GetTubeNo()
+        position[i] = [pmt.GetPosition(j) for j in range(3)]
+        orientation[i] = [pmt.GetOrientation(j) for j in range(3)]
+    return {
+        "tube_no": tube_no,
+        "position": position,
+        "orientation": orientation
+    }
+
+
+def get_event_info_from_tracks(tracks):
+    """
+    Returns the pid, position, direction and energy of the simulated particle, given a dictionary of arrays of pid,
+    flag, parent, start_position, direction, energy and momentum of (at least) the primary tracks of the first trigger
+    """
+    # Primary particles with no parent are the initial simulation
+    particles = np.flatnonzero((tracks["flag"] == 0) & (tracks["parent"] == 0))
+    # Check there is exactly one particle with no parent:
+    if len(particles) == 1:
+        # Only one primary, this is the particle being simulated
+        return {
+            "pid": tracks["pid"][particles[0]],
+            "position": tracks["start_position"][particles[0]],
+            "direction": tracks["direction"][particles[0]],
+            "energy": tracks["energy"][particles[0]]
+        }
+    # Particle with flag -1 is the incoming neutrino or 'dummy neutrino' used for gamma
+    # WCSim saves the gamma details (except position) in the neutrino track with flag -1
+    neutrino = np.flatnonzero(tracks["flag"] == -1)
+    # Check for dummy neutrino that actually stores a gamma that converts to e+ / e-
+    isConversion = len(particles) == 2 and set(tracks["pid"][particles]) == {11, -11}
+    if isConversion and len(neutrino) == 1 and tracks["pid"][neutrino[0]] == 22:
+        return {
+            "pid": 22,
+            "position": tracks["start_position"][particles[0]],  # e+ / e- should have same position
+            "direction": tracks["direction"][neutrino[0]],
+            "energy": tracks["energy"][neutrino[0]]
+        }
+    momentum = np.sum(tracks["direction"][particles] * tracks["momentum"][particles, None], axis=0)
+    norm = np.sqrt(np.sum(momentum ** 2))
+    # Check for dummy neutrino from old gamma simulations that didn't save the gamma info
+    if isConversion and len(neutrino) == 1 and tracks["pid"][neutrino[0]] == 12 and tracks["energy"][neutrino[0]] < 0.0001:
+        # Should be a positron/electron pair from a gamma simulation (temporary hack since no gamma truth saved)
+        return {
+            "pid": 22,
+            "position": tracks["start_position"][particles[0]],  # e+ / e- should have same position
+            "direction": momentum / norm,
+            "energy": np.sum(tracks["energy"][particles])
+        }
+    # Otherwise something else is going on... guess info from the primaries
+    return {
+        "pid": 0,  # there's more than one particle so just use pid 0
+        "position": np.mean(tracks["start_position"][particles], axis=0),  # average position
+        "direction": momentum / norm,  # direction of sum of momenta
+        "energy": np.sum(tracks["energy"][particles])  # sum of energies
+    }
+
 
 class WCSim:
     def __init__(self, tree):
@@ -11,6 +90,10 @@ class WCSim:
         self.geotree.GetEntry(0)
         self.geo = self.geotree.wcsimrootgeom
         self.num_pmts = self.geo.GetWCNumPMT()
+        self.pmt_geometry = None
+        # Photon start times and positions are only available with the tracking branch of WCSim
+        self.photon_tracking = hasattr(ROOT.WCSimRootCherenkovHitTime, "GetPhotonStartTime")
+        self.compiled_photons = None
         self.tree = tree
         self.nevent = self.tree.GetEntries()
         print("number of entries in the tree: " + str(self.nevent))
@@ -22,6 +105,13 @@ class WCSim:
         self.trigger = self.event.GetTrigger(0)
         self.current_trigger = 0
 
+    def get_pmt_geometry(self):
+        # Geometry arrays are only read from the geometry tree once, on first use, so that hit positions can be
+        # looked up with a single array index instead of calls to geo.GetPMT for every hit
+        if self.pmt_geometry is None:
+            self.pmt_geometry = load_pmt_geometry(self.geo)
+        return self.pmt_geometry
+
     def get_event(self, ev):
         # Delete previous triggers to prevent memory leak (only if file does not change)
         triggers = [self.event.GetTrigger(i) for i in range(self.ntrigger)]
@@ -67,53 +157,19 @@ class WCSim:
 
     def get_event_info(self):
         self.get_trigger(0)
-        tracks = self.trigger.GetTracks()
-        # Primary particles with no parent are the initial simulation
-        particles = [t for t in tracks if t.GetFlag() == 0 and t.GetParenttype() == 0]
-        # Check there is exactly one particle with no parent:
-        if len(particles) == 1:
-            # Only one primary, this is the particle being simulated
-            return {
-                "pid": particles[0].GetIpnu(),
-                "position": [particles[0].GetStart(i) for i in range(3)],
-                "direction": [particles[0].GetDir(i) for i in range(3)],
-                "energy": particles[0].GetE()
-            }
-        # Particle with flag -1 is the incoming neutrino or 'dummy neutrino' used for gamma
-        # WCSim saves the gamma details (except position) in the neutrino track with flag -1
-        neutrino = [t for t in tracks if t.GetFlag() == -1]
-        # Check for dummy neutrino that actually stores a gamma that converts to e+ / e-
-        isConversion = len(particles) == 2 and {p.GetIpnu() for p in particles} == {11, -11}
-        if isConversion and len(neutrino) == 1 and neutrino[0].GetIpnu() == 22:
-            return {
-                "pid": 22,
-                "position": [particles[0].GetStart(i) for i in range(3)], # e+ / e- should have same position
-                "direction": [neutrino[0].GetDir(i) for i in range(3)],
-                "energy": neutrino[0].GetE()
-            }
-        # Check for dummy neutrino from old gamma simulations that didn't save the gamma info
-        if isConversion and len(neutrino) == 1 and neutrino[0].GetIpnu() == 12 and neutrino[0].GetE() < 0.0001:
-            # Should be a positron/electron pair from a gamma simulation (temporary hack since no gamma truth saved)
-            momentum = [sum(p.GetDir(i) * p.GetP() for p in particles) for i in range(3)]
-            norm = np.sqrt(sum(p ** 2 for p in momentum))
-            return {
-                "pid": 22,
-                "position": [particles[0].GetStart(i) for i in range(3)],  # e+ / e- should have same position
-                "direction": [p / norm for p in momentum],
-                "energy": sum(p.GetE() for p in particles)
-            }
-        # Otherwise something else is going on... guess info from the primaries
-        momentum = [sum(p.GetDir(i) * p.GetP() for p in particles) for i in range(3)]
-        norm = np.sqrt(sum(p ** 2 for p in momentum))
-        return {
-            "pid": 0,  # there's more than one particle so just use pid 0
-            "position": [sum(p.GetStart(i) for p in particles)/len(particles) for i in range(3)],  # average position
-            "direction": [p / norm for p in momentum],  # direction of sum of momenta
-            "energy": sum(p.GetE() for p in particles)  # sum of energies
-        }
+        # Only primary particles with no parent and the incoming (or 'dummy') neutrino are needed for the event info
+        tracks = [t for t in self.trigger.GetTracks() if t.GetFlag() == -1 or (t.GetFlag() == 0 and t.GetParenttype() == 0)]
+        return get_event_info_from_tracks({
+            "pid": np.array([t.GetIpnu() for t in tracks], dtype=np.int32),
+            "flag": np.array([t.GetFlag() for t in tracks], dtype=np.int32),
+            "parent": np.array([t.GetParenttype() for t in tracks], dtype=np.int32),
+            "start_position": np.array([[t.GetStart(i) for i in range(3)] for t in tracks]).reshape(-1, 3),
+            "direction": np.array([[t.GetDir(i) for i in range(3)] for t in tracks]).reshape(-1, 3),
+            "energy": np.array([t.GetE() for t in tracks]),
+            "momentum": np.array([t.GetP() for t in tracks])
+        })
 
     def get_digitized_hits(self):
-        position = []
         charge = []
         time = []
         pmt = []
@@ -121,87 +177,107 @@ class WCSim:
         for t in range(self.ntrigger):
             self.get_trigger(t)
             for hit in self.trigger.GetCherenkovDigiHits():
-                pmt_id = hit.GetTubeId() - 1
-                position.append([self.geo.GetPMT(pmt_id).GetPosition(j) for j in range(3)])
                 charge.append(hit.GetQ())
                 time.append(hit.GetT())
-                pmt.append(pmt_id)
+                pmt.append(hit.GetTubeId() - 1)
                 trigger.append(t)
+        pmt = np.asarray(pmt, dtype=np.int32)
         hits = {
-            "position": np.asarray(position, dtype=np.float32),
+            "position": self.get_pmt_geometry()["position"][pmt].astype(np.float32),
             "charge": np.asarray(charge, dtype=np.float32),
             "time": np.asarray(time, dtype=np.float32),
-            "pmt": np.asarray(pmt, dtype=np.int32),
+            "pmt": pmt,
             "trigger": np.asarray(trigger, dtype=np.int32)
         }
         return hits
 
     def get_true_hits(self):
-        position = []
-        track = []
         pmt = []
+        first_photon = []
         PE = []
         trigger = []
+        photon_parents = []
+        photon_count = 0
         for t in range(self.ntrigger):
             self.get_trigger(t)
             for hit in self.trigger.GetCherenkovHits():
-                pmt_id = hit.GetTubeID() - 1
-                tracks = set()
-                for j in range(hit.GetTotalPe(0), hit.GetTotalPe(0)+hit.GetTotalPe(1)):
-                    pe = self.trigger.GetCherenkovHitTimes().At(j)
-                    tracks.add(pe.GetParentID())
-                position.append([self.geo.GetPMT(pmt_id).GetPosition(k) for k in range(3)])
-                track.append(tracks.pop() if len(tracks) == 1 else -2)
-                pmt.append(pmt_id)
+                pmt.append(hit.GetTubeID() - 1)
+                # photons are indexed within each trigger, so shift them to index the parents of all triggers
+                first_photon.append(hit.GetTotalPe(0) + photon_count)
                 PE.append(hit.GetTotalPe(1))
                 trigger.append(t)
+            photon_parents.extend(p.GetParentID() for p in self.trigger.GetCherenkovHitTimes())
+            photon_count = len(photon_parents)
+        pmt = np.asarray(pmt, dtype=np.int32)
+        PE = np.asarray(PE, dtype=np.int32)
+        # each hit's track is the parent of its photons if they all share the same parent, otherwise -2
+        hit_offsets = offsets_from_counts(PE)
+        photons = np.repeat(np.asarray(first_photon, dtype=np.int64) - hit_offsets[:-1], PE) + np.arange(hit_offsets[-1])
+        parents = np.asarray(photon_parents, dtype=np.int32)[photons]
         hits = {
-            "position": np.asarray(position, dtype=np.float32),
-            "track": np.asarray(track, dtype=np.int32),
-            "pmt": np.asarray(pmt, dtype=np.int32),
-            "PE": np.asarray(PE, dtype=np.int32),
+            "position": self.get_pmt_geometry()["position"][pmt].astype(np.float32),
+            "track": segment_common_value(parents, hit_offsets, mixed=-2),
+            "pmt": pmt,
+            "PE": PE,
             "trigger": np.asarray(trigger, dtype=np.int32)
         }
         return hits
 
     def get_hit_photons(self):
-        start_position = []
-        end_position = []
-        start_time = []
-        end_time = []
-        track = []
-        pmt = []
-        trigger = []
+        # With the tracking branch, each photon has nine values to read, so read them in the compiled loop of
+        # wcsim_columns.h if it can be used, rather than through PyROOT
+        if self.photon_tracking and self.compiled_photons is None:
+            self.compiled_photons = declare_columns_reader()
+        if self.photon_tracking and self.compiled_photons:
+            return self.get_hit_photons_compiled()
+        n_photons = [self.event.GetTrigger(t).GetNcherenkovhittimes() for t in range(self.ntrigger)]
+        total_photons = sum(n_photons)
+        photons = {
+            "start_position": np.zeros((total_photons, 3), dtype=np.float32),
+            "end_position": np.zeros((total_photons, 3), dtype=np.float32),
+            "start_time": np.zeros(total_photons, dtype=np.float32),
+            "end_time": np.empty(total_photons, dtype=np.float32),
+            "track": np.empty(total_photons, dtype=np.int32),
+            "pmt": np.empty(total_photons, dtype=np.int32),
+            "trigger": np.repeat(np.arange(self.ntrigger, dtype=np.int32), n_photons)
+        }
+        end_time = photons["end_time"]
+        track = photons["track"]
+        start_time = photons["start_time"]
+        start_position = photons["start_position"]
+        end_position = photons["end_position"]
+        photon = 0
+        pmt = 0
         for t in range(self.ntrigger):
             self.get_trigger(t)
-            n_photons = self.trigger.GetNcherenkovhittimes()
-            trigger.append(np.full(n_photons, t, dtype=np.int32))
-            counts = [h.GetTotalPe(1) for h in self.trigger.GetCherenkovHits()]
-            hit_pmts = [h.GetTubeID()-1 for h in self.trigger.GetCherenkovHits()]
-            pmt.append(np.repeat(hit_pmts, counts))
-            end_time.append(np.zeros(n_photons, dtype=np.float32))
-            track.append(np.zeros(n_photons, dtype=np.int32))
-            start_time.append(np.zeros(n_photons, dtype=np.float32))
-            start_position.append(np.zeros((n_photons, 3), dtype=np.float32))
-            end_position.append(np.zeros((n_photons, 3), dtype=np.float32))
-            photons = self.trigger.GetCherenkovHitTimes()
-            end_time[t][:] = [p.GetTruetime() for p in photons]
-            track[t][:] = [p.GetParentID() for p in photons]
-            try:  # Only works with new tracking branch of WCSim
-                start_time[t][:] = [p.GetPhotonStartTime() for p in photons]
-                for i in range(3):
-                    start_position[t][:,i] = [p.GetPhotonStartPos(i)/10 for p in photons]
-                    end_position[t][:,i] = [p.GetPhotonEndPos(i)/10 for p in photons]
-            except AttributeError: # leave as zeros if not using tracking branch
-                pass
+            for h in self.trigger.GetCherenkovHits():
+                count = h.GetTotalPe(1)
+                photons["pmt"][pmt:pmt+count] = h.GetTubeID() - 1
+                pmt += count
+            # Each photon is visited once, filling all of its values
+            for p in self.trigger.GetCherenkovHitTimes():
+                end_time[photon] = p.GetTruetime()
+                track[photon] = p.GetParentID()
+                if self.photon_tracking:
+                    start_time[photon] = p.GetPhotonStartTime()
+                    start_position[photon] = [p.GetPhotonStartPos(i)/10 for i in range(3)]
+                    end_position[photon] = [p.GetPhotonEndPos(i)/10 for i in range(3)]
+                photon += 1
+        return photons
+
+    def get_hit_photons_compiled(self):
+        columns = ROOT.wcsim_columns.Columns()
+        for t in range(self.ntrigger):
+            self.get_trigger(t)
+            ROOT.wcsim_columns.ReadHitPhotons(self.trigger, t, columns)
         photons = {
-            "start_position": np.concatenate(start_position),
-            "end_position": np.concatenate(end_position),
-            "start_time": np.concatenate(start_time),
-            "end_time": np.concatenate(end_time),
-            "track": np.concatenate(track),
-            "pmt": np.concatenate(pmt),
-            "trigger": np.concatenate(trigger)
+            "start_position": vector_to_numpy(columns.photon_start_position, np.float32, 3),
+            "end_position": vector_to_numpy(columns.photon_end_position, np.float32, 3),
+            "start_time": vector_to_numpy(columns.photon_start_time, np.float32),
+            "end_time": vector_to_numpy(columns.photon_end_time, np.float32),
+            "track": vector_to_numpy(columns.photon_track, np.int32),
+            "pmt": vector_to_numpy(columns.photon_pmt, np.int32),
+            "trigger": vector_to_numpy(columns.photon_trigger, np.int32)
         }
         return photons
 
@@ -214,6 +290,7 @@ class WCSim:
         stop_position = []
         parent = []
         flag = []
+        trigger = []
         for t in range(self.ntrigger):
             self.get_trigger(t)
             for track in self.trigger.GetTracks():
@@ -225,15 +302,17 @@ class WCSim:
                 stop_position.append([track.GetStop(i) for i in range(3)])
                 parent.append(track.GetParenttype())
                 flag.append(track.GetFlag())
+                trigger.append(t)
         tracks = {
             "id": np.asarray(track_id, dtype=np.int32),
             "pid": np.asarray(pid, dtype=np.int32),
             "start_time": np.asarray(start_time, dtype=np.float32),
             "energy": np.asarray(energy, dtype=np.float32),
-            "start_position": np.asarray(start_position, dtype=np.float32),
-            "stop_position": np.asarray(stop_position, dtype=np.float32),
+            "start_position": np.asarray(start_position, dtype=np.float32).reshape(-1, 3),
+            "stop_position": np.asarray(stop_position, dtype=np.float32).reshape(-1, 3),
             "parent": np.asarray(parent, dtype=np.int32),
-            "flag": np.asarray(flag, dtype=np.int32)
+            "flag": np.asarray(flag, dtype=np.int32),
+            "trigger": np.asarray(trigger, dtype=np.int32)
         }
         return tracks
 
@@ -253,6 +332,30 @@ class WCSim:
         }
         return triggers
 
+    def iter_batches(self, fields=FIELDS, batch_size=1000, start=0, stop=None):
+        """
+        Iterate over events [start, stop) in batches of batch_size events, yielding for each batch a dictionary of the
+        given fields concatenated over the batch's events, in the same flat format as WCSimColumns.read
+        """
+        if stop is None:
+            stop = self.nevent
+        for batch_start in range(start, stop, batch_size):
+            batch_stop = min(batch_start + batch_size, stop)
+            events = {field: [] for field in fields}
+            ntriggers = np.empty(batch_stop - batch_start, dtype=np.int64)
+            for i, ev in enumerate(range(batch_start, batch_stop)):
+                self.get_event(ev)
+                ntriggers[i] = self.ntrigger
+                for field in fields:
+                    events[field].append(getattr(self, "get_" + field)())
+            batch = {"event_id": np.arange(batch_start, batch_stop, dtype=np.int32)}
+            for field in fields:
+                if field == "event_info":
+                    batch[field] = {k: np.array([e[k] for e in events[field]]) for k in events[field][0]}
+                else:
+                    batch[field] = concatenate_events(events[field], ntriggers)
+            yield batch
+
 
 class WCSimFile(WCSim):
     def __init__(self, filename):
@@ -266,13 +369,283 @@ class WCSimFile(WCSim):
 
 
 class WCSimChain(WCSim):
-    def __init__(self, filenames):
-        self.chain = ROOT.TChain("wcsimT")
+    """
+    Reads a list of WCSim files as one sequence of events, numbered across all files.
+
+    Only one file is open at a time: when an event in a different file is requested, the current file is closed
+    (after clearing its last event) and the other one is opened, so memory use does not grow with the number of files.
+    While a file is being processed, the next one is read through in a background thread so that it is already in the
+    page cache when it is opened.
+    """
+    def __init__(self, filenames, prefetch=True):
+        chain = ROOT.TChain("wcsimT")
         for file in filenames:
-            self.chain.Add(file)
-        self.file = self.GetFile()
+            chain.Add(file)
+        self.nevent = chain.GetEntries()
+        self.filenames = [f.GetTitle() for f in chain.GetListOfFiles()]
+        # global event number of the first event of each file, and the total number of events at the end
+        tree_offsets = chain.GetTreeOffset()
+        self.file_offsets = np.array([tree_offsets[i] for i in range(len(self.filenames))] + [self.nevent],
+                                     dtype=np.int64)
+        del chain
+        print("number of entries in the chain of " + str(len(self.filenames)) + " files: " + str(self.nevent))
+        self.prefetcher = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        self.wcsim = None
+        self.current_file = None
+        self.num_pmts = None
+        self.pmt_geometry = None
+        self.open_file(self.get_file_index(0))
+        self.photon_tracking = self.wcsim.photon_tracking
+        self.compiled_photons = None
+
+    def __del__(self):
+        self.close_file()
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown(wait=False)
+
+    def get_file_index(self, ev):
+        """Returns the index of the file containing the given global event number"""
+        return min(int(np.searchsorted(self.file_offsets, ev, side="right")) - 1, len(self.filenames) - 1)
+
+    def close_file(self):
+        if self.wcsim is None:
+            return
+        # The triggers of the file's last event are not deleted by WCSim.get_event, so clear them before closing
+        self.wcsim.event.ReInitialize()
+        self.wcsim.file.Close()
+        self.wcsim = None
+        self.event = None
+        self.trigger = None
+        self.geo = None
+
+    def open_file(self, file_index):
+        self.close_file()
+        self.wcsim = WCSimFile(self.filenames[file_index])
+        self.current_file = file_index
+        self.geo = self.wcsim.geo
+        # The PMT geometry is assumed to be the same for all files, only reloading it if the number of PMTs changes
+        if self.wcsim.num_pmts != self.num_pmts:
+            self.num_pmts = self.wcsim.num_pmts
+            self.pmt_geometry = None
+        self.tree = self.wcsim.tree
+        self.event = self.wcsim.event
+        self.ntrigger = self.wcsim.ntrigger
+        self.trigger = self.wcsim.trigger
+        self.current_event = int(self.file_offsets[file_index])
+        self.current_trigger = 0
+        if self.prefetcher is not None and file_index + 1 < len(self.filenames):
+            self.prefetcher.submit(prefetch_file, self.filenames[file_index + 1])
+
+    def get_event(self, ev):
+        file_index = self.get_file_index(ev)
+        if file_index != self.current_file:
+            self.open_file(file_index)
+        self.wcsim.get_event(int(ev - self.file_offsets[file_index]))
+        self.current_event = ev
+        self.event = self.wcsim.event
+        self.ntrigger = self.wcsim.ntrigger
+
+
+def prefetch_file(filename, block_size=1 << 24):
+    """Read through a local file without keeping its contents, so that it is in the page cache when it is opened"""
+    if not os.path.isfile(filename):
+        return
+    with open(filename, "rb") as f:
+        while f.read(block_size):
+            pass
+
+
+class WCSimColumns:
+    """
+    Reads whole ranges of events of a WCSim file at once into flat numpy arrays, using the compiled loops in
+    wcsim_columns.h instead of accessing each hit, photon and track through PyROOT.
+
+    Each field is returned as a dictionary with the same arrays as the corresponding WCSim.get_<field>() method, but
+    concatenated over all events, along with `event_offsets` giving the boundaries of each event in the flat arrays
+    (event i is in [event_offsets[i], event_offsets[i+1])) and, for hits, photons and tracks, `trigger_offsets` giving
+    the boundaries of each trigger.
+    """
+    def __init__(self, filename):
+        if not declare_columns_reader():
+            raise RuntimeError("Could not compile " + columns_header + " for reading WCSim files")
+        self.file = ROOT.TFile(filename, "read")
+        self.tree = self.file.Get("wcsimT")
         self.geotree = self.file.Get("wcsimGeoT")
-        super().__init__(self.chain)
+        self.geotree.GetEntry(0)
+        self.geo = self.geotree.wcsimrootgeom
+        self.num_pmts = self.geo.GetWCNumPMT()
+        self.pmt_geometry = None
+        self.nevent = self.tree.GetEntries()
+
+    def __del__(self):
+        self.file.Close()
+
+    def get_pmt_geometry(self):
+        if self.pmt_geometry is None:
+            self.pmt_geometry = load_pmt_geometry(self.geo)
+        return self.pmt_geometry
+
+    def read(self, fields=FIELDS, start=0, stop=None):
+        """Read the given fields of events [start, stop), returning a dictionary of the fields and the event ids"""
+        if stop is None:
+            stop = self.nevent
+        for field in fields:
+            if field not in FIELDS:
+                raise ValueError("Unknown field " + field + ", should be one of " + str(FIELDS))
+        read_tracks = "tracks" in fields or "event_info" in fields
+        flags = ((ROOT.wcsim_columns.kDigitizedHits if "digitized_hits" in fields else 0) |
+                 (ROOT.wcsim_columns.kTrueHits if "true_hits" in fields else 0) |
+                 (ROOT.wcsim_columns.kHitPhotons if "hit_photons" in fields else 0) |
+                 (ROOT.wcsim_columns.kTracks if read_tracks else 0))
+        columns = ROOT.wcsim_columns.Columns()
+        ROOT.wcsim_columns.Read(self.tree, start, stop, flags, columns)
+        trigger_event_offsets = vector_to_numpy(columns.trigger_event_offsets, np.int64)
+        data = {"event_id": np.arange(start, stop, dtype=np.int32)}
+        if "triggers" in fields:
+            data["triggers"] = {
+                "time": vector_to_numpy(columns.trigger_time, np.float32),
+                "type": vector_to_numpy(columns.trigger_type, np.int32),
+                "event_offsets": trigger_event_offsets
+            }
+        if "digitized_hits" in fields:
+            trigger_offsets = vector_to_numpy(columns.digi_hit_trigger_offsets, np.int64)
+            pmt = vector_to_numpy(columns.digi_hit_pmt, np.int32)
+            data["digitized_hits"] = {
+                "position": self.get_pmt_geometry()["position"][pmt].astype(np.float32),
+                "charge": vector_to_numpy(columns.digi_hit_charge, np.float32),
+                "time": vector_to_numpy(columns.digi_hit_time, np.float32),
+                "pmt": pmt,
+                "trigger": vector_to_numpy(columns.digi_hit_trigger, np.int32),
+                "event_offsets": trigger_offsets[trigger_event_offsets],
+                "trigger_offsets": trigger_offsets
+            }
+        if "true_hits" in fields:
+            trigger_offsets = vector_to_numpy(columns.true_hit_trigger_offsets, np.int64)
+            pmt = vector_to_numpy(columns.true_hit_pmt, np.int32)
+            data["true_hits"] = {
+                "position": self.get_pmt_geometry()["position"][pmt].astype(np.float32),
+                "track": vector_to_numpy(columns.true_hit_track, np.int32),
+                "pmt": pmt,
+                "PE": vector_to_numpy(columns.true_hit_PE, np.int32),
+                "trigger": vector_to_numpy(columns.true_hit_trigger, np.int32),
+                "event_offsets": trigger_offsets[trigger_event_offsets],
+                "trigger_offsets": trigger_offsets
+            }
+        if "hit_photons" in fields:
+            trigger_offsets = vector_to_numpy(columns.photon_trigger_offsets, np.int64)
+            data["hit_photons"] = {
+                "start_position": vector_to_numpy(columns.photon_start_position, np.float32, 3),
+                "end_position": vector_to_numpy(columns.photon_end_position, np.float32, 3),
+                "start_time": vector_to_numpy(columns.photon_start_time, np.float32),
+                "end_time": vector_to_numpy(columns.photon_end_time, np.float32),
+                "track": vector_to_numpy(columns.photon_track, np.int32),
+                "pmt": vector_to_numpy(columns.photon_pmt, np.int32),
+                "trigger": vector_to_numpy(columns.photon_trigger, np.int32),
+                "event_offsets": trigger_offsets[trigger_event_offsets],
+                "trigger_offsets": trigger_offsets
+            }
+        if read_tracks:
+            trigger_offsets = vector_to_numpy(columns.track_trigger_offsets, np.int64)
+            energy = vector_to_numpy(columns.track_energy, np.float64)
+            start_position = vector_to_numpy(columns.track_start_position, np.float64, 3)
+            tracks = {
+                "id": vector_to_numpy(columns.track_id, np.int32),
+                "pid": vector_to_numpy(columns.track_pid, np.int32),
+                "start_time": vector_to_numpy(columns.track_start_time, np.float32),
+                "energy": energy.astype(np.float32),
+                "start_position": start_position.astype(np.float32),
+                "stop_position": vector_to_numpy(columns.track_stop_position, np.float32, 3),
+                "parent": vector_to_numpy(columns.track_parent, np.int32),
+                "flag": vector_to_numpy(columns.track_flag, np.int32),
+                "trigger": vector_to_numpy(columns.track_trigger, np.int32),
+                "event_offsets": trigger_offsets[trigger_event_offsets],
+                "trigger_offsets": trigger_offsets
+            }
+            if "event_info" in fields:
+                # event info only uses the tracks of the first trigger of each event
+                has_trigger = np.diff(trigger_event_offsets) > 0
+                first_trigger = np.minimum(trigger_event_offsets[:-1], len(trigger_offsets) - 2)
+                first_trigger_counts = np.where(has_trigger, np.diff(trigger_offsets)[first_trigger], 0)
+                first_trigger_tracks = segment_indices(trigger_offsets[first_trigger], first_trigger_counts)
+                data["event_info"] = get_event_info_from_flat_tracks({
+                    "pid": tracks["pid"][first_trigger_tracks],
+                    "flag": tracks["flag"][first_trigger_tracks],
+                    "parent": tracks["parent"][first_trigger_tracks],
+                    "start_position": start_position[first_trigger_tracks],
+                    "direction": vector_to_numpy(columns.track_direction, np.float64, 3)[first_trigger_tracks],
+                    "energy": energy[first_trigger_tracks],
+                    "momentum": vector_to_numpy(columns.track_momentum, np.float64)[first_trigger_tracks],
+                    "event_offsets": offsets_from_counts(first_trigger_counts)
+                })
+            if "tracks" in fields:
+                data["tracks"] = tracks
+        return data
+
+    def iter_batches(self, fields=FIELDS, batch_size=10000, start=0, stop=None):
+        """Iterate over events [start, stop), reading batch_size events at a time"""
+        if stop is None:
+            stop = self.nevent
+        for batch_start in range(start, stop, batch_size):
+            yield self.read(fields, batch_start, min(batch_start + batch_size, stop))
+
+
+def concatenate_events(events, ntriggers):
+    """
+    Concatenate a list of per-event dictionaries of arrays, as returned by the WCSim.get_<field>() methods, into flat
+    arrays with event_offsets and, if the arrays include each object's trigger, trigger_offsets
+    """
+    flat = {k: np.concatenate([e[k] for e in events]) for k in events[0]}
+    flat["event_offsets"] = offsets_from_counts([len(next(iter(e.values()))) for e in events])
+    if "trigger" in flat:
+        # objects are stored trigger by trigger, so the trigger boundaries follow from counting objects per trigger
+        trigger_counts = [np.bincount(e["trigger"], minlength=n) for e, n in zip(events, ntriggers)]
+        flat["trigger_offsets"] = offsets_from_counts(np.concatenate(trigger_counts))
+    return flat
+
+
+def vector_to_numpy(vector, dtype, width=None):
+    """Copy a std::vector filled by the compiled WCSim reader into a numpy array, optionally of shape (n, width)"""
+    array = np.array(vector, dtype=dtype) if vector.size() > 0 else np.empty(0, dtype=dtype)
+    return array if width is None else array.reshape(-1, width)
+
+
+def segment_indices(starts, counts):
+    """Returns the indices of all elements of the segments [starts[i], starts[i]+counts[i]) concatenated together"""
+    offsets = offsets_from_counts(counts)
+    return np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], counts)
+
+
+def get_event_info_from_flat_tracks(tracks):
+    """
+    Returns the event info arrays of many events, given the flat arrays of the tracks of their first triggers
+    (as for get_event_info_from_tracks) with event_offsets giving the boundaries of each event's tracks
+    """
+    offsets = tracks["event_offsets"]
+    n_events = len(offsets) - 1
+    event_info = {
+        "pid": np.empty(n_events, dtype=np.int32),
+        "position": np.empty((n_events, 3), dtype=np.float64),
+        "direction": np.empty((n_events, 3), dtype=np.float64),
+        "energy": np.empty(n_events, dtype=np.float64)
+    }
+    track_event = np.repeat(np.arange(n_events), np.diff(offsets))
+    is_particle = (tracks["flag"] == 0) & (tracks["parent"] == 0)
+    n_particles = np.bincount(track_event[is_particle], minlength=n_events)
+    # Most events have a single primary particle, so take those directly from the particle's track
+    single_particle = n_particles[track_event] == 1
+    single = is_particle & single_particle
+    single_events = track_event[single]
+    event_info["pid"][single_events] = tracks["pid"][single]
+    event_info["position"][single_events] = tracks["start_position"][single]
+    event_info["direction"][single_events] = tracks["direction"][single]
+    event_info["energy"][single_events] = tracks["energy"][single]
+    for ev in np.flatnonzero(n_particles != 1):
+        event_tracks = {k: v[offsets[ev]:offsets[ev+1]] for k, v in tracks.items() if k != "event_offsets"}
+        info = get_event_info_from_tracks(event_tracks)
+        for k, v in info.items():
+            event_info[k][ev] = v
+    return event_info
+
 
 def get_label(infile):
     if "_gamma" in infile:
@@ -0,0 +1,100 @@
+"""
+Python 3 script for converting a list of WCSim ROOT files directly into one hdf5 file of digitized hit arrays
+
+The output has the same layout as np_to_digihit_array_hdf5.py, keeping the hits of the earliest trigger of type 0 in
+each event, but is written in a single pass over the ROOT files, without the intermediate .npz files of event_dump.py.
+"""
+
+import argparse
+import sys
+import subprocess
+from datetime import datetime
+import h5py
+from root_utils.root_file_utils import *
+from root_utils.event_utils import get_labels, get_angles, get_veto, first_trigger_indices, select_trigger_hits
+from root_utils.h5_utils import (STORAGE_PROFILES, create_digihit_datasets, buffered_writers, flush_all,
+                                 relayout_contiguous)
+
+ROOT.gROOT.SetBatch(True)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='convert WCSim ROOT files into one hdf5 file of digitized hits')
+    parser.add_argument('input_files', type=str, nargs='+')
+    parser.add_argument('-o', '--output_file', type=str)
+    parser.add_argument('-p', '--profile', choices=list(STORAGE_PROFILES), default='fast-read',
+                        help='storage layout and compression of the output datasets: fast-read (contiguous, '
+                             'uncompressed), balanced (small lzf chunks) or archive (gzip)')
+    parser.add_argument('--buffer-mb', type=float, default=64,
+                        help='size in MB of the in-memory buffer of each output dataset, written out in blocks')
+    parser.add_argument('-H', '--half-height', type=float, default=300)
+    parser.add_argument('-R', '--radius', type=float, default=400)
+    parser.add_argument('-c', '--columnar', action='store_true',
+                        help='read each file in bulk with WCSimColumns instead of event by event')
+    parser.add_argument('-b', '--batch-size', type=int, default=1000, help='number of events to read at a time')
+    args = parser.parse_args()
+    return args
+
+
+def convert_file(infile, writers, config):
+    wcsim = WCSimColumns(infile) if config.columnar else WCSimFile(infile)
+    fields = ("event_info", "digitized_hits", "tracks", "triggers")
+    for batch in wcsim.iter_batches(fields=fields, batch_size=config.batch_size):
+        nevents = len(batch["event_id"])
+        event_info = batch["event_info"]
+        hits = batch["digitized_hits"]
+        tracks = batch["tracks"]
+        triggers = batch["triggers"]
+
+        # keep the hits of the earliest trigger of type 0 of each event
+        event_triggers = first_trigger_indices(triggers["time"], triggers["event_offsets"], triggers["type"] == 0)
+        selected_hits, event_nhits = select_trigger_hits(hits["trigger"], hits["event_offsets"], event_triggers)
+        veto, veto2 = get_veto(tracks["pid"], tracks["energy"], tracks["start_position"], tracks["stop_position"],
+                               tracks["event_offsets"], config.radius, config.half_height)
+
+        hit_offset = writers["hit_pmt"].size
+        writers["event_hits_index"].write(hit_offset + np.cumsum(event_nhits) - event_nhits)
+        writers["hit_time"].write(hits["time"][selected_hits])
+        writers["hit_charge"].write(hits["charge"][selected_hits])
+        writers["hit_pmt"].write(hits["pmt"][selected_hits])
+        writers["event_ids"].write(batch["event_id"])
+        writers["root_files"].write([infile] * nevents)
+        writers["labels"].write(get_labels(event_info["pid"]))
+        writers["energies"].write(event_info["energy"].reshape(-1, 1))
+        writers["positions"].write(event_info["position"].reshape(-1, 1, 3))
+        writers["angles"].write(get_angles(event_info["direction"]))
+        writers["veto"].write(veto)
+        writers["veto2"].write(veto2)
+    del wcsim
+
+
+if __name__ == '__main__':
+    config = get_args()
+    print("ouput file:", config.output_file)
+    f = h5py.File(config.output_file, 'w')
+
+    script_path = os.path.dirname(os.path.abspath(__file__))
+    git_status = subprocess.check_output(['git', '-C', script_path, 'status', '--porcelain', '--untracked-files=no']).decode()
+    if git_status:
+        raise Exception("Directory of this script ({}) is not a clean git directory:\n{}Need a clean git directory for storing script version in output file.".format(script_path, git_status))
+    git_describe = subprocess.check_output(['git', '-C', script_path, 'describe', '--always', '--long', '--tags']).decode().strip()
+    print("git describe for path to this script ({}):".format(script_path), git_describe)
+    f.attrs['git-describe'] = git_describe
+    f.attrs['command'] = str(sys.argv)
+    f.attrs['timestamp'] = str(datetime.now())
+
+    datasets = create_digihit_datasets(f, config.profile)
+    writers = buffered_writers(datasets, config.buffer_mb)
+    file_count = len(config.input_files)
+    for current_file, input_file in enumerate(config.input_files):
+        if not os.path.isfile(input_file):
+            raise ValueError(input_file+" does not exist")
+        input_file = os.path.abspath(input_file)
+        print("Now processing " + input_file + " (" + str(current_file+1) + "/" + str(file_count) + ")", flush=True)
+        convert_file(input_file, writers, config)
+
+    flush_all(writers)
+    print("saved", writers["hit_pmt"].dset.shape[0], "hits in", writers["event_ids"].dset.shape[0], "events")
+    f.close()
+    if config.profile == "fast-read":
+        relayout_contiguous(config.output_file)
@@ -0,0 +1,204 @@
+/*
+ * Bulk extraction of WCSim events into flat columns, used from python by root_file_utils.WCSimColumns
+ *
+ * Instead of accessing every hit, photon and track through PyROOT, whole ranges of entries of the wcsimT tree are
+ * read here in compiled loops that fill one std::vector per column. The vectors are then copied into numpy arrays.
+ *
+ * For each group of objects (digitized hits, true hits, photons, tracks) the *_trigger_offsets vector has one entry
+ * per trigger plus one at the end, giving where that trigger's objects start in the group's flat columns.
+ * The trigger_event_offsets vector has one entry per event plus one at the end, giving where that event's triggers
+ * start in the trigger columns, so an event's objects start at *_trigger_offsets[trigger_event_offsets[event]].
+ */
+#ifndef WCSIM_COLUMNS_H
+#define WCSIM_COLUMNS_H
+
+#include <climits>
+#include <vector>
+
+#include "TBranch.h"
+#include "TClonesArray.h"
+#include "TTree.h"
+
+#include "WCSimRootEvent.hh"
+
+namespace wcsim_columns {
+
+enum Fields {
+    kDigitizedHits = 1,
+    kTrueHits = 2,
+    kHitPhotons = 4,
+    kTracks = 8
+};
+
+struct Columns {
+    std::vector<Long64_t> trigger_event_offsets;
+    std::vector<float> trigger_time;
+    std::vector<int> trigger_type;
+
+    std::vector<Long64_t> digi_hit_trigger_offsets;
+    std::vector<int> digi_hit_pmt;
+    std::vector<float> digi_hit_charge;
+    std::vector<float> digi_hit_time;
+    std::vector<int> digi_hit_trigger;
+
+    std::vector<Long64_t> true_hit_trigger_offsets;
+    std::vector<int> true_hit_pmt;
+    std::vector<int> true_hit_PE;
+    std::vector<int> true_hit_track;
+    std::vector<int> true_hit_trigger;
+
+    std::vector<Long64_t> photon_trigger_offsets;
+    std::vector<int> photon_pmt;
+    std::vector<int> photon_track;
+    std::vector<int> photon_trigger;
+    std::vector<float> photon_start_time;
+    std::vector<float> photon_end_time;
+    std::vector<float> photon_start_position;  // 3 values per photon
+    std::vector<float> photon_end_position;  // 3 values per photon
+
+    std::vector<Long64_t> track_trigger_offsets;
+    std::vector<int> track_id;
+    std::vector<int> track_pid;
+    std::vector<int> track_parent;
+    std::vector<int> track_flag;
+    std::vector<int> track_trigger;
+    std::vector<float> track_start_time;
+    // kept as double, as PyROOT returns them, so that the event info of the primary particle matches WCSim
+    std::vector<double> track_energy;
+    std::vector<double> track_momentum;
+    std::vector<double> track_start_position;  // 3 values per track
+    std::vector<double> track_stop_position;  // 3 values per track
+    std::vector<double> track_direction;  // 3 values per track
+};
+
+// Photon start times and positions only exist in the tracking branch of WCSim, otherwise they are filled with zeros
+template <typename HitTime>
+auto FillPhotonTracking(HitTime *photon, Columns &columns, int) -> decltype(photon->GetPhotonStartTime(), void()) {
+    columns.photon_start_time.push_back(photon->GetPhotonStartTime());
+    for (int i = 0; i < 3; ++i) {
+        columns.photon_start_position.push_back(photon->GetPhotonStartPos(i) / 10);
+        columns.photon_end_position.push_back(photon->GetPhotonEndPos(i) / 10);
+    }
+}
+
+template <typename HitTime>
+void FillPhotonTracking(HitTime *, Columns &columns, long) {
+    columns.photon_start_time.push_back(0);
+    columns.photon_start_position.insert(columns.photon_start_position.end(), 3, 0);
+    columns.photon_end_position.insert(columns.photon_end_position.end(), 3, 0);
+}
+
+inline void ReadDigitizedHits(WCSimRootTrigger *trigger, int trigger_index, Columns &columns) {
+    columns.digi_hit_trigger_offsets.push_back(columns.digi_hit_pmt.size());
+    TClonesArray *hits = trigger->GetCherenkovDigiHits();
+    for (int i = 0; i < hits->GetEntriesFast(); ++i) {
+        auto *hit = static_cast<WCSimRootCherenkovDigiHit *>(hits->At(i));
+        if (!hit) continue;
+        columns.digi_hit_pmt.push_back(hit->GetTubeId() - 1);
+        columns.digi_hit_charge.push_back(hit->GetQ());
+        columns.digi_hit_time.push_back(hit->GetT());
+        columns.digi_hit_trigger.push_back(trigger_index);
+    }
+}
+
+inline void ReadTrueHits(WCSimRootTrigger *trigger, int trigger_index, Columns &columns) {
+    columns.true_hit_trigger_offsets.push_back(columns.true_hit_pmt.size());
+    TClonesArray *hits = trigger->GetCherenkovHits();
+    TClonesArray *photons = trigger->GetCherenkovHitTimes();
+    for (int i = 0; i < hits->GetEntriesFast(); ++i) {
+        auto *hit = static_cast<WCSimRootCherenkovHit *>(hits->At(i));
+        if (!hit) continue;
+        // The hit's track is the parent of its photons if they all share the same parent, otherwise -2
+        int track = -2;
+        int first_photon = hit->GetTotalPe(0);
+        int last_photon = first_photon + hit->GetTotalPe(1);
+        for (int j = first_photon; j < last_photon; ++j) {
+            int parent = static_cast<WCSimRootCherenkovHitTime *>(photons->At(j))->GetParentID();
+            if (j == first_photon) {
+                track = parent;
+            } else if (parent != track) {
+                track = -2;
+                break;
+            }
+        }
+        columns.true_hit_pmt.push_back(hit->GetTubeID() - 1);
+        columns.true_hit_PE.push_back(hit->GetTotalPe(1));
+        columns.true_hit_track.push_back(track);
+        columns.true_hit_trigger.push_back(trigger_index);
+    }
+}
+
+inline void ReadHitPhotons(WCSimRootTrigger *trigger, int trigger_index, Columns &columns) {
+    columns.photon_trigger_offsets.push_back(columns.photon_track.size());
+    TClonesArray *hits = trigger->GetCherenkovHits();
+    for (int i = 0; i < hits->GetEntriesFast(); ++i) {
+        auto *hit = static_cast<WCSimRootCherenkovHit *>(hits->At(i));
+        if (!hit) continue;
+        columns.photon_pmt.insert(columns.photon_pmt.end(), hit->GetTotalPe(1), hit->GetTubeID() - 1);
+    }
+    TClonesArray *photons = trigger->GetCherenkovHitTimes();
+    for (int i = 0; i < photons->GetEntriesFast(); ++i) {
+        auto *photon = static_cast<WCSimRootCherenkovHitTime *>(photons->At(i));
+        if (!photon) continue;
+        columns.photon_end_time.push_back(photon->GetTruetime());
+        columns.photon_track.push_back(photon->GetParentID());
+        columns.photon_trigger.push_back(trigger_index);
+        FillPhotonTracking(photon, columns, 0);
+    }
+}
+
+inline void ReadTracks(WCSimRootTrigger *trigger, int trigger_index, Columns &columns) {
+    columns.track_trigger_offsets.push_back(columns.track_id.size());
+    TClonesArray *tracks = trigger->GetTracks();
+    for (int i = 0; i < tracks->GetEntriesFast(); ++i) {
+        auto *track = static_cast<WCSimRootTrack *>(tracks->At(i));
+        if (!track) continue;
+        columns.track_id.push_back(track->GetId());
+        columns.track_pid.push_back(track->GetIpnu());
+        columns.track_parent.push_back(track->GetParenttype());
+        columns.track_flag.push_back(track->GetFlag());
+        columns.track_trigger.push_back(trigger_index);
+        columns.track_start_time.push_back(track->GetTime());
+        columns.track_energy.push_back(track->GetE());
+        columns.track_momentum.push_back(track->GetP());
+        for (int j = 0; j < 3; ++j) {
+            columns.track_start_position.push_back(track->GetStart(j));
+            columns.track_stop_position.push_back(track->GetStop(j));
+            columns.track_direction.push_back(track->GetDir(j));
+        }
+    }
+}
+
+// Read the requested fields (a combination of the Fields flags) of entries [start, stop) of a wcsimT tree
+inline void Read(TTree *tree, Long64_t start, Long64_t stop, int fields, Columns &columns) {
+    WCSimRootEvent *event = new WCSimRootEvent();
+    tree->SetBranchAddress("wcsimrootevent", &event);
+    tree->GetBranch("wcsimrootevent")->SetAutoDelete(kTRUE);
+    for (Long64_t entry = start; entry < stop; ++entry) {
+        tree->GetEntry(entry);
+        columns.trigger_event_offsets.push_back(columns.trigger_time.size());
+        for (int t = 0; t < event->GetNumberOfEvents(); ++t) {
+            WCSimRootTrigger *trigger = event->GetTrigger(t);
+            columns.trigger_time.push_back(trigger->GetHeader()->GetDate());
+            Long64_t trigger_type = trigger->GetTriggerType();
+            columns.trigger_type.push_back(trigger_type > INT_MAX ? -1 : trigger_type);
+            if (fields & kDigitizedHits) ReadDigitizedHits(trigger, t, columns);
+            if (fields & kTrueHits) ReadTrueHits(trigger, t, columns);
+            if (fields & kHitPhotons) ReadHitPhotons(trigger, t, columns);
+            if (fields & kTracks) ReadTracks(trigger, t, columns);
+        }
+        // Remove the triggers of this event, otherwise they are kept in memory when reading the next entry
+        event->ReInitialize();
+    }
+    columns.trigger_event_offsets.push_back(columns.trigger_time.size());
+    if (fields & kDigitizedHits) columns.digi_hit_trigger_offsets.push_back(columns.digi_hit_pmt.size());
+    if (fields & kTrueHits) columns.true_hit_trigger_offsets.push_back(columns.true_hit_pmt.size());
+    if (fields & kHitPhotons) columns.photon_trigger_offsets.push_back(columns.photon_track.size());
+    if (fields & kTracks) columns.track_trigger_offsets.push_back(columns.track_id.size());
+    tree->ResetBranchAddresses();
+    delete event;
+}
+
+}  // namespace wcsim_columns
+
+#endif
@@ -0,0 +1,49 @@
+import numpy as np
+
+from root_utils.flat_npz import EventFile
+from root_utils.event_utils import get_event_info
+
+
+def object_array(arrays):
+    result = np.empty(len(arrays), dtype=object)
+    for i, a in enumerate(arrays):
+        result[i] = a
+    return result
+
+
+def test_event_info_with_zero_track_event(tmp_path):
+    """Older object array files store the tracks of events without any tracks as arrays of shape (0,)"""
+    path = tmp_path / "events.npz"
+    np.savez(path,
+             event_id=np.arange(3), root_file=np.array(["x.root"]*3), pid=np.array([13, 11, 13]),
+             energy=np.array([500., 100., 300.], dtype=np.float32),
+             position=np.zeros((3, 3), dtype=np.float32),
+             direction=np.tile(np.array([0., 1., 0.], dtype=np.float32), (3, 1)),
+             track_pid=object_array([np.array([13]), np.array([]), np.array([13])]),
+             track_energy=object_array([np.array([1000.], dtype=np.float32), np.array([]),
+                                        np.array([300.], dtype=np.float32)]),
+             track_start_position=object_array([np.zeros((1, 3), dtype=np.float32), np.array([]),
+                                                np.zeros((1, 3), dtype=np.float32)]),
+             track_stop_position=object_array([np.array([[0., 301., 0.]], dtype=np.float32), np.array([]),
+                                               np.array([[0., 10., 0.]], dtype=np.float32)]))
+    npz_file = EventFile(str(path))
+    assert npz_file.values("track_start_position").shape == (2, 3)
+    assert npz_file.values("track_start_position").dtype == np.float32
+    event_info = get_event_info(npz_file)
+    np.testing.assert_array_equal(event_info["veto"], [True, False, False])
+    np.testing.assert_array_equal(event_info["veto2"], [True, False, False])
+    npz_file.close()
+
+
+def test_event_info_without_tracks(tmp_path):
+    path = tmp_path / "events.npz"
+    empty = object_array([np.array([])]*2)
+    np.savez(path,
+             event_id=np.arange(2), root_file=np.array(["x.root"]*2), pid=np.array([13, 11]),
+             energy=np.array([500., 100.], dtype=np.float32), position=np.zeros((2, 3), dtype=np.float32),
+             direction=np.tile(np.array([0., 1., 0.], dtype=np.float32), (2, 1)),
+             track_pid=empty, track_energy=empty, track_start_position=empty, track_stop_position=empty)
+    npz_file = EventFile(str(path))
+    event_info = get_event_info(npz_file)
+    np.testing.assert_array_equal(event_info["veto"], [False, False])
+    npz_file.close()
@@ -0,0 +1,74 @@
+import h5py
+import numpy as np
+import pytest
+
+from root_utils.flat_npz import EventFile
+from root_utils.geometry import GEOMETRIES
+from root_utils.grid_dataset import HitGridDataset, hits_to_grids
+import root_utils.np_to_grid_hdf5_hyperk as hyperk
+import root_utils.np_to_grid_hdf5_hyperk_mpmt as hyperk_mpmt
+
+
+def object_array(arrays):
+    result = np.empty(len(arrays), dtype=object)
+    for i, a in enumerate(arrays):
+        result[i] = a
+    return result
+
+
+def make_files(tmp_path, n_pmts, n_events=20, seed=0):
+    """
+    Writes an npz file of events with a single trigger each, so that the grid converters and the digitized hit arrays
+    keep the same hits, and a hit array file of the same hits
+    """
+    rng = np.random.default_rng(seed)
+    n_hits = rng.integers(0, 300, n_events)
+    pmts = [rng.integers(0, n_pmts, n).astype(np.int32) for n in n_hits]
+    charges = [rng.uniform(0.1, 5, n).astype(np.float32) for n in n_hits]
+    times = [rng.uniform(0, 2000, n).astype(np.float32) for n in n_hits]
+    npz_path = tmp_path / "events.npz"
+    np.savez(npz_path,
+             digi_hit_pmt=object_array(pmts), digi_hit_charge=object_array(charges),
+             digi_hit_time=object_array(times),
+             digi_hit_trigger=object_array([np.zeros(n, dtype=np.int32) for n in n_hits]),
+             trigger_time=object_array([np.zeros(1, dtype=np.float32)]*n_events),
+             trigger_type=object_array([np.zeros(1, dtype=np.int32)]*n_events))
+    h5_path = tmp_path / "hits.h5"
+    with h5py.File(h5_path, "w") as f:
+        f["event_hits_index"] = np.cumsum(n_hits) - n_hits
+        f["hit_pmt"] = np.concatenate(pmts)
+        f["hit_charge"] = np.concatenate(charges)
+        f["hit_time"] = np.concatenate(times)
+        f["event_ids"] = np.arange(n_events)
+    return npz_path, h5_path
+
+
+@pytest.mark.parametrize("name, converter", [("hyperk", hyperk), ("hyperk_mpmt", hyperk_mpmt)])
+def test_hit_grids_match_converter(tmp_path, name, converter):
+    geometry = GEOMETRIES[name]
+    npz_path, h5_path = make_files(tmp_path, geometry.n_pmts)
+    npz_file = EventFile(str(npz_path))
+    expected = np.concatenate(list(converter.event_grids(npz_file, block_size=7)))
+    npz_file.close()
+    dataset = HitGridDataset(str(h5_path), geometry=name)
+    assert dataset.grid_shape == converter.grid_shape
+    grids = dataset.get_grids(np.arange(len(dataset)))
+    assert grids.shape == expected.shape
+    assert np.count_nonzero(expected) > 0
+    np.testing.assert_array_equal(grids, expected)
+    events = [5, 0, 5, 12]
+    np.testing.assert_array_equal(dataset.get_batch(events)["event_data"], expected[events])
+    dataset.close()
+
+
+def test_hits_to_grids_checks_out():
+    geometry = GEOMETRIES["hyperk_mpmt"]
+    hit_offsets = np.array([0, 1, 1])
+    args = (hit_offsets, np.array([0]), np.array([1.], dtype=np.float32), np.array([2.], dtype=np.float32), geometry)
+    out = np.empty((4,) + geometry.window_shape, dtype=np.float32)
+    assert hits_to_grids(*args, out=out).base is out
+    for bad_out in (np.empty((4,) + geometry.grid_shape, dtype=np.float32),
+                    np.empty((4,) + geometry.window_shape, dtype=np.float64),
+                    np.empty((1,) + geometry.window_shape, dtype=np.float32)):
+        with pytest.raises(ValueError):
+            hits_to_grids(*args, out=bad_out)
@@ -0,0 +1,40 @@
+import h5py
+import numpy as np
+
+from root_utils.hit_array_dataset import HitArrayDataset, select_triggers
+
+
+def make_file(path):
+    """
+    Writes a hit array file in the --all-triggers layout with three events:
+        event 0: type 0 triggers at times 5, without hits, and 10, with hits 0-2
+        event 1: a type 1 trigger at time 20 with hits 3-4, and a type 0 trigger at time 7 with hits 5-6
+        event 2: a type 0 trigger at time 1 with hit 7
+    """
+    with h5py.File(path, "w") as f:
+        f["event_hits_index"] = np.array([0, 3, 7])
+        f["event_triggers_index"] = np.array([0, 2, 4])
+        f["trigger_hits_index"] = np.array([0, 0, 3, 5, 7])
+        f["trigger_time"] = np.array([5, 10, 20, 7, 1], dtype=np.float32)
+        f["trigger_type"] = np.array([0, 0, 1, 0, 0], dtype=np.int32)
+        f["hit_pmt"] = np.arange(8, dtype=np.int32)
+        f["hit_trigger"] = np.array([1, 1, 1, 0, 0, 1, 1, 0], dtype=np.int32)
+        f["event_ids"] = np.arange(3)
+
+
+def test_first_trigger_without_hits(tmp_path):
+    make_file(tmp_path / "hits.h5")
+    dataset = HitArrayDataset(str(tmp_path / "hits.h5"))
+    # event 0's earliest type 0 trigger has no hits, so it is left out instead of using its later trigger
+    selection = select_triggers(dataset)
+    np.testing.assert_array_equal(selection["event"], [1, 2])
+    np.testing.assert_array_equal(selection["trigger"], [3, 4])
+    np.testing.assert_array_equal(selection["hit_start"], [5, 7])
+    np.testing.assert_array_equal(selection["hit_stop"], [7, 8])
+    selection = select_triggers(dataset, min_hits=2)
+    np.testing.assert_array_equal(selection["event"], [1])
+    selection = select_triggers(dataset, policy="each")
+    np.testing.assert_array_equal(selection["trigger"], [1, 3, 4])
+    selection = select_triggers(dataset, policy="all", min_hits=3)
+    np.testing.assert_array_equal(selection["event"], [0])
+    dataset.close()